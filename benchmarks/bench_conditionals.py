@@ -0,0 +1,173 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+# load time of every conditional of one device, Conditional.load_all
+# against the SCAN and lrange, then hgetall on error, lookups that
+# update_conditions made before conditionals were indexed
+#
+#   python3 benchmarks/bench_conditionals.py --db-host 127.0.0.1 --db-port 6380
+#
+# conditionals are stored for a bench_device_* uid, use a scratch
+# redis server anyway
+
+import argparse
+import os
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+from enn_ui import dev_ui  # noqa: E402
+from enn_ui.startup import connect  # noqa: E402
+from bench_reference import best_of  # noqa: E402
+
+
+def make_conditionals(device, count, settings):
+    return [
+        dev_ui.Conditional(
+            name="bench_{}".format(number),
+            device=device,
+            pre_contents=["[env:bench_{0}] == {0}".format(number)],
+            set_contents={
+                "prop_{}".format(setting): str(number) for setting in range(settings)
+            },
+            post_contents=["[env:bench_{}] = done".format(number)],
+        )
+        for number in range(count)
+    ]
+
+
+def device_template_values(device):
+    connection_kwargs = dev_ui.redis_conn.connection_pool.connection_kwargs
+    return {
+        "device": device,
+        "host": connection_kwargs["host"],
+        "port": connection_kwargs["port"],
+    }
+
+
+def scan_load(device):
+    # a scan per step, then a lrange per step key and a
+    # hgetall for every set key after its WRONGTYPE error
+    redis_conn = dev_ui.redis_conn
+    template_values = dict(device_template_values(device), name="*")
+    found = {}
+    for step in dev_ui.Conditional.step_types:
+        template_values.update({"step": step})
+        pattern = dev_ui.Conditional.key_template.format_map(template_values)
+        for key in redis_conn.scan_iter(match=pattern):
+            _, _, name, *_ = key.split(":")
+            found.setdefault(name, {})[step] = key
+
+    conditionals = []
+    for name, steps in found.items():
+        conditional = dev_ui.Conditional(name=name, device=device)
+        for step, key in steps.items():
+            try:
+                contents = redis_conn.lrange(key, 0, -1)
+            except Exception:
+                contents = redis_conn.hgetall(key)
+            if contents:
+                setattr(conditional, step + "_contents", contents)
+        conditionals.append(conditional)
+    return conditionals
+
+
+def by_name(conditionals):
+    return {
+        conditional.name: (
+            conditional.pre_contents,
+            conditional.set_contents,
+            conditional.post_contents,
+        )
+        for conditional in conditionals
+    }
+
+
+def remove_device(device):
+    redis_conn = dev_ui.redis_conn
+    template_values = device_template_values(device)
+    pattern = dev_ui.Conditional.key_template.format_map(
+        dict(template_values, step="*", name="*")
+    )
+    keys = list(redis_conn.scan_iter(match=pattern))
+    pipe = redis_conn.pipeline(transaction=True)
+    if keys:
+        pipe.delete(*keys)
+    pipe.delete(dev_ui.Conditional.index_template.format_map(template_values))
+    pipe.srem(dev_ui.Conditional.indexed_template.format_map(template_values), device)
+    pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--conditionals",
+        type=int,
+        nargs="+",
+        default=[100, 500, 1000],
+        help="conditionals per device",
+    )
+    parser.add_argument(
+        "--settings", type=int, default=10, help="settings per conditional"
+    )
+    parser.add_argument(
+        "--other-keys",
+        type=int,
+        default=10000,
+        help="unrelated keys in the db, scanned by the old lookup",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeats")
+    parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
+    parser.add_argument("--db-port", type=int, required=True, help="db port")
+    args = parser.parse_args()
+
+    _, dev_ui.redis_conn = connect(args.db_host, args.db_port)
+    other_keys = ["bench:other:{}".format(number) for number in range(args.other_keys)]
+    for start in range(0, len(other_keys), 1000):
+        dev_ui.redis_conn.mset({key: "" for key in other_keys[start : start + 1000]})
+
+    print("conditionals  scan s  load_all s  backfill s")
+    try:
+        for count in args.conditionals:
+            device = "bench_device_{}".format(count)
+            conditionals = make_conditionals(device, count, args.settings)
+            dev_ui.Conditional.store_many(conditionals)
+            try:
+                scan_seconds, scanned = best_of(args.repeat, scan_load, device)
+                load_seconds, loaded = best_of(
+                    args.repeat, dev_ui.Conditional.load_all, device
+                )
+                # both lookups find the same conditionals
+                assert by_name(scanned) == by_name(loaded)
+                assert len(loaded) == count
+
+                # a device not marked as indexed, as for conditionals
+                # stored before the index, scans once to fill it
+                indexed_key = dev_ui.Conditional.indexed_template.format_map(
+                    device_template_values(device)
+                )
+                backfill_seconds = float("inf")
+                for _ in range(args.repeat):
+                    dev_ui.redis_conn.srem(indexed_key, device)
+                    seconds, backfilled = best_of(
+                        1, dev_ui.Conditional.load_all, device
+                    )
+                    backfill_seconds = min(backfill_seconds, seconds)
+                    assert by_name(backfilled) == by_name(loaded)
+            finally:
+                remove_device(device)
+            print(
+                "{:12d} {:7.4f} {:11.4f} {:11.4f}".format(
+                    count, scan_seconds, load_seconds, backfill_seconds
+                )
+            )
+    finally:
+        for start in range(0, len(other_keys), 1000):
+            dev_ui.redis_conn.delete(*other_keys[start : start + 1000])
+
+
+if __name__ == "__main__":
+    main()
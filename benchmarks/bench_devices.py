@@ -0,0 +1,159 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+# enn-dev ui time of a rediscovery with several cameras, reconcile_devices
+# after the first discovery, with nothing changed, with one camera
+# disconnecting or connecting and with one camera at a new usb address
+#
+#   python3 benchmarks/bench_devices.py --db-host 127.0.0.1 --db-port 6380
+#
+# widgets are created without opening a window and no camera is needed,
+# discovery results are generated. scripts:bench_* keys are written,
+# use a scratch redis server
+
+import argparse
+import os
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+from kivy.uix.boxlayout import BoxLayout  # noqa: E402
+from kivy.uix.label import Label  # noqa: E402
+from enn_ui import dev_ui  # noqa: E402
+from enn_ui.db_events import KeyspaceWatcher  # noqa: E402
+from bench_reference import best_of  # noqa: E402
+
+
+def discovered_devices(cameras):
+    # what a gphoto2 discover() returns per camera
+    return [
+        {
+            "name": "bench camera {}".format(camera),
+            "uid": "bench_{}".format(camera),
+            "address": "usb:001,{:03d}".format(camera + 10),
+            "discovery": "gphoto2",
+        }
+        for camera in range(cameras)
+    ]
+
+
+def fill_reference(cameras, settings):
+    pipe = dev_ui.redis_conn.pipeline(transaction=True)
+    for camera in range(cameras):
+        script = "bench_script_{}".format(camera)
+        pipe.hset(
+            dev_ui.ReferenceCache.lookup_key, "bench camera {}".format(camera), script
+        )
+        pipe.hmset(
+            dev_ui.ReferenceCache.script_key_prefix + script,
+            {
+                "prop_{}".format(setting): "-eluar set_prop({0}, {{prop_{0}}})".format(
+                    setting
+                )
+                for setting in range(settings)
+            },
+        )
+    pipe.execute()
+
+
+def remove_bench_keys(cameras):
+    # reference keys and the conditionals index entries
+    # load_all adds for each camera
+    connection_kwargs = dev_ui.redis_conn.connection_pool.connection_kwargs
+    indexed_key = dev_ui.Conditional.indexed_template.format(
+        host=connection_kwargs["host"], port=connection_kwargs["port"]
+    )
+    pipe = dev_ui.redis_conn.pipeline(transaction=True)
+    pipe.srem(indexed_key, *["bench_{}".format(camera) for camera in range(cameras)])
+    for camera in range(cameras):
+        pipe.hdel(dev_ui.ReferenceCache.lookup_key, "bench camera {}".format(camera))
+        pipe.delete(
+            dev_ui.ReferenceCache.script_key_prefix + "bench_script_{}".format(camera)
+        )
+    pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cameras", type=int, default=8, help="connected cameras")
+    parser.add_argument("--settings", type=int, default=50, help="settings per camera")
+    parser.add_argument("--repeat", type=int, default=10, help="best of repeats")
+    parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
+    parser.add_argument("--db-port", type=int, required=True, help="db port")
+    parser.add_argument(
+        "--virtual-lists", action="store_true", help="use virtual settings lists"
+    )
+    args = parser.parse_args()
+
+    app = dev_ui.DevApp(
+        db_host=args.db_host,
+        db_port=args.db_port,
+        refresh_interval=0,
+        virtual_lists=args.virtual_lists,
+        preview_mode="process",
+        usb_vendor=None,
+        usb_settle=1.0,
+        capture_sync_timeout=30.0,
+    )
+    # only the parts of build() that reconcile_devices uses, without
+    # device classes or usb monitoring
+    app.devices_by_uid = {}
+    app.device_container = BoxLayout()
+    app.device_container.empty_notice = Label(text="no devices. plug something in")
+    app.db_events = KeyspaceWatcher(dev_ui.redis_conn)
+    fill_reference(args.cameras, args.settings)
+
+    try:
+        discovered = discovered_devices(args.cameras)
+        first_seconds, _ = best_of(1, app.reconcile_devices, discovered)
+        assert len(app.devices_by_uid) == args.cameras
+
+        unchanged_seconds, _ = best_of(
+            args.repeat, app.reconcile_devices, discovered_devices(args.cameras)
+        )
+
+        # the last camera disconnects, then connects again
+        disconnected = discovered_devices(args.cameras)[:-1]
+        disconnect_seconds = connect_seconds = float("inf")
+        for _ in range(args.repeat):
+            seconds, _ = best_of(1, app.reconcile_devices, disconnected)
+            disconnect_seconds = min(disconnect_seconds, seconds)
+            seconds, _ = best_of(
+                1, app.reconcile_devices, discovered_devices(args.cameras)
+            )
+            connect_seconds = min(connect_seconds, seconds)
+        assert app.devices_by_uid["bench_0"].device.connected
+
+        # the first camera re-enumerates at a new usb address
+        moved_seconds = float("inf")
+        for move in range(args.repeat):
+            moved = discovered_devices(args.cameras)
+            moved[0]["address"] = "usb:002,{:03d}".format(move)
+            seconds, _ = best_of(1, app.reconcile_devices, moved)
+            moved_seconds = min(moved_seconds, seconds)
+        assert app.devices_by_uid["bench_0"].device.details["address"] == (
+            "usb:002,{:03d}".format(args.repeat - 1)
+        )
+
+        print("cameras  first ms  unchanged ms  disconnect ms  connect ms  moved ms")
+        print(
+            "{:7d} {:9.3f} {:13.3f} {:14.3f} {:11.3f} {:9.3f}".format(
+                args.cameras,
+                first_seconds * 1000,
+                unchanged_seconds * 1000,
+                disconnect_seconds * 1000,
+                connect_seconds * 1000,
+                moved_seconds * 1000,
+            )
+        )
+    finally:
+        for device_widget in list(app.devices_by_uid.values()):
+            app.remove_device(device_widget)
+        remove_bench_keys(args.cameras)
+
+
+if __name__ == "__main__":
+    main()
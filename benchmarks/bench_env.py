@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+# enn-env refresh time for envs with many fields, a full rebuild
+# (what every db event cost before rows were reconciled) against
+# reconciling after no change, one changed, one added and one
+# removed field
+#
+#   python3 benchmarks/bench_env.py --db-host 127.0.0.1 --db-port 6380
+#
+# widgets are created without opening a window. the env is written
+# to bench:env:{host}:{port}, use a scratch redis server anyway
+
+import argparse
+import os
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+from enn_ui import env_ui  # noqa: E402
+from bench_reference import best_of  # noqa: E402
+
+
+def fill_env(env_key, fields):
+    pipe = env_ui.redis_conn.pipeline(transaction=False)
+    pipe.delete(env_key)
+    for start in range(0, fields, 1000):
+        pipe.hmset(
+            env_key,
+            {
+                "field_{}".format(field): "value_{}".format(field)
+                for field in range(start, min(fields, start + 1000))
+            },
+        )
+    pipe.execute()
+
+
+def rebuild(app):
+    # drop every row, the next refresh creates them all again
+    for row in app.env_rows.values():
+        app.env_container.remove_widget(row)
+    app.env_rows.clear()
+    app.update_env_values()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--fields", type=int, nargs="+", default=[10, 1000, 10000], help="env sizes"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeats")
+    parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
+    parser.add_argument("--db-port", type=int, required=True, help="db port")
+    parser.add_argument(
+        "--virtual-lists", action="store_true", help="refresh the virtual list"
+    )
+    args = parser.parse_args()
+
+    app = env_ui.EnvApp(
+        db_host=args.db_host,
+        db_port=args.db_port,
+        refresh_interval=0,
+        virtual_lists=args.virtual_lists,
+    )
+    env_key = "bench:env:{}:{}".format(app.db_host, app.db_port)
+    app.env_key = env_key
+    env_ui.redis_conn.delete(env_key)
+    app.root = app.build()
+
+    print("fields  rebuild s  unchanged s  changed s  added s  removed s")
+    try:
+        for fields in args.fields:
+            fill_env(env_key, fields)
+            if args.virtual_lists:
+                rebuild_seconds, _ = best_of(args.repeat, app.update_env_values)
+            else:
+                rebuild_seconds, _ = best_of(args.repeat, rebuild, app)
+            unchanged_seconds, _ = best_of(args.repeat, app.update_env_values)
+
+            def change_field():
+                env_ui.redis_conn.hset(env_key, "field_0", os.urandom(4).hex())
+                app.update_env_values()
+
+            def add_field():
+                env_ui.redis_conn.hset(env_key, "added", "value")
+                app.update_env_values()
+
+            def remove_field():
+                env_ui.redis_conn.hdel(env_key, "added")
+                app.update_env_values()
+
+            changed_seconds, _ = best_of(args.repeat, change_field)
+            added_seconds = removed_seconds = float("inf")
+            for _ in range(args.repeat):
+                added_seconds = min(added_seconds, best_of(1, add_field)[0])
+                removed_seconds = min(removed_seconds, best_of(1, remove_field)[0])
+            print(
+                "{:6d} {:10.4f} {:12.4f} {:10.4f} {:8.4f} {:10.4f}".format(
+                    fields,
+                    rebuild_seconds,
+                    unchanged_seconds,
+                    changed_seconds,
+                    added_seconds,
+                    removed_seconds,
+                )
+            )
+    finally:
+        app.db_events.stop()
+        env_ui.redis_conn.delete(env_key)
+
+
+if __name__ == "__main__":
+    main()
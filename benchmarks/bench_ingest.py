@@ -0,0 +1,101 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+# sequential and parallel ingestion of many reference xml files
+#
+#   python3 benchmarks/bench_ingest.py --db-host 127.0.0.1 --db-port 6380
+#
+# without --db-port only parsing is timed, with it populate_db is
+# timed too. use a scratch redis server since scripts:bench_* keys
+# are written
+
+import argparse
+import pathlib
+import tempfile
+import redis
+from enn_ui import reference
+from bench_reference import best_of, remove_benchmark_keys, write_reference_xml
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files", type=int, nargs="+", default=[1, 4, 16, 32], help="file counts"
+    )
+    parser.add_argument("--scripts", type=int, default=500, help="scripts per file")
+    parser.add_argument("--calls", type=int, default=20, help="calls per script")
+    parser.add_argument(
+        "--shared", type=int, default=10, help="scripts defined in every file"
+    )
+    parser.add_argument("--jobs", type=int, default=4, help="parallel processes")
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeats")
+    parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
+    parser.add_argument("--db-port", type=int, help="also time populate_db")
+    args = parser.parse_args()
+
+    redis_conn = None
+    if args.db_port:
+        redis_conn = redis.StrictRedis(
+            host=args.db_host, port=args.db_port, decode_responses=True
+        )
+
+    header = "files  parse seq s  parse {0} jobs s  populate seq s  populate {0} jobs s"
+    print(header.format(args.jobs))
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_count in args.files:
+            xml_files = []
+            for file_number in range(file_count):
+                xml_file = pathlib.Path(tmp, "propset_{}.xml".format(file_number))
+                if not xml_file.exists():
+                    write_reference_xml(
+                        xml_file, args.scripts, args.calls, shared=args.shared
+                    )
+                xml_files.append(xml_file)
+
+            timings = []
+            results = []
+            for jobs in (1, args.jobs):
+                # the parse stage of populate_db, without the cache
+                seconds, merged = best_of(
+                    args.repeat, reference.parse_references, xml_files, jobs=jobs
+                )
+                timings.append(seconds)
+                results.append(merged)
+            # conflicts resolve the same way in both paths, last file wins
+            assert results[0] == results[1]
+            if args.shared:
+                shared_key = reference.SCRIPT_LOOKUP_KEY.format("bench_shared_0")
+                assert all(
+                    template.endswith(xml_files[-1].stem)
+                    for template in results[0][shared_key].values()
+                )
+
+            for jobs in (1, args.jobs):
+                if redis_conn is None:
+                    timings.append(float("nan"))
+                    continue
+                seconds, _ = best_of(
+                    args.repeat,
+                    reference.populate_db,
+                    args.db_host,
+                    args.db_port,
+                    xml_files,
+                    incremental=False,
+                    jobs=jobs,
+                    cache_path=None,
+                )
+                timings.append(seconds)
+                remove_benchmark_keys(redis_conn)
+            print(
+                "{:5d} {:12.4f} {:15.4f} {:15.4f} {:18.4f}".format(file_count, *timings)
+            )
+    if redis_conn is not None:
+        # the files digest now refers to benchmark files
+        redis_conn.hdel(reference.REFERENCE_DIGESTS_KEY, reference.FILES_DIGEST_FIELD)
+
+
+if __name__ == "__main__":
+    main()
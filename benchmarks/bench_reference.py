@@ -0,0 +1,138 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+# parse time of synthetic reference xml with thousands of scripts,
+# time per script should stay flat as the script count grows
+#
+#   python3 benchmarks/bench_reference.py
+#   python3 benchmarks/bench_reference.py --db-host 127.0.0.1 --db-port 6380
+#
+# with --db-port the parsed reference is also written with populate_db,
+# use a scratch redis server since scripts:bench_* keys are written
+
+import argparse
+import pathlib
+import tempfile
+import time
+import redis
+from enn_ui import reference
+
+
+def write_reference_xml(path, scripts, calls, prefix="bench", shared=0):
+    # scripts with calls each and one device per script, the
+    # first shared scripts have the same names in every file
+    # and templates that differ per file
+    with open(str(path), "w") as f:
+        f.write("<reference>\n")
+        for script in range(scripts):
+            script_name = "{}_{}_{}".format(
+                prefix, "shared" if script < shared else path.stem, script
+            )
+            f.write(
+                '    <device name="{} camera" script="{}" />\n'.format(
+                    script_name, script_name
+                )
+            )
+            f.write('    <script name="{}">\n'.format(script_name))
+            for call in range(calls):
+                f.write(
+                    '        <call name="prop_{0}" '
+                    'template="-eluar set_prop({0}, {{prop_{0}}}) -- {1}" />\n'.format(
+                        call, path.stem
+                    )
+                )
+            f.write("    </script>\n")
+        f.write("</reference>\n")
+
+
+def best_of(repeat, func, *args, **kwargs):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds.append(time.perf_counter() - started)
+    return min(seconds), result
+
+
+def remove_benchmark_keys(redis_conn, prefix="bench"):
+    pattern = reference.SCRIPT_LOOKUP_KEY.format(prefix + "_*")
+    script_keys = list(redis_conn.scan_iter(match=pattern))
+    devices = [
+        device
+        for device in redis_conn.hkeys(reference.DEVICE_SCRIPT_LOOKUP_KEY)
+        if device.startswith(prefix + "_")
+    ]
+    pipe = redis_conn.pipeline(transaction=True)
+    if script_keys:
+        pipe.delete(*script_keys)
+        pipe.hdel(reference.REFERENCE_DIGESTS_KEY, *script_keys)
+    if devices:
+        pipe.hdel(reference.DEVICE_SCRIPT_LOOKUP_KEY, *devices)
+    pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scripts",
+        type=int,
+        nargs="+",
+        default=[1000, 2000, 4000, 8000],
+        help="script counts",
+    )
+    parser.add_argument("--calls", type=int, default=20, help="calls per script")
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeats")
+    parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
+    parser.add_argument("--db-port", type=int, help="also time populate_db")
+    args = parser.parse_args()
+
+    redis_conn = None
+    if args.db_port:
+        redis_conn = redis.StrictRedis(
+            host=args.db_host, port=args.db_port, decode_responses=True
+        )
+
+    print("scripts  calls    parse s  us/script  populate s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for scripts in args.scripts:
+            xml_file = pathlib.Path(tmp, "reference_{}.xml".format(scripts))
+            write_reference_xml(xml_file, scripts, args.calls)
+            seconds, parsed = best_of(args.repeat, reference.parse_reference, xml_file)
+            # every script only holds its own calls
+            assert len(parsed) == scripts + 1
+            assert all(
+                len(calls) == args.calls
+                for key, calls in parsed.items()
+                if key != reference.DEVICE_SCRIPT_LOOKUP_KEY
+            )
+            populate_seconds = float("nan")
+            if redis_conn is not None:
+                populate_seconds, _ = best_of(
+                    args.repeat,
+                    reference.populate_db,
+                    args.db_host,
+                    args.db_port,
+                    [xml_file],
+                    incremental=False,
+                    cache_path=None,
+                )
+                remove_benchmark_keys(redis_conn)
+            print(
+                "{:7d} {:6d} {:10.4f} {:10.2f} {:11.4f}".format(
+                    scripts,
+                    scripts * args.calls,
+                    seconds,
+                    seconds / scripts * 1e6,
+                    populate_seconds,
+                )
+            )
+    if redis_conn is not None:
+        # the files digest now refers to a benchmark file
+        redis_conn.hdel(reference.REFERENCE_DIGESTS_KEY, reference.FILES_DIGEST_FIELD)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+import threading
+
+from kivy.clock import Clock
+
+
+class KeyspaceWatcher(object):
+    # keyspace notifications for specific keys only,
+    # instead of psubscribing to every key in the db.
+    # keys can be watched / unwatched while running
+    def __init__(self, redis_conn, db=0):
+        self.channel_prefix = "__keyspace@{}__:".format(db)
+        self.pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        self.thread = None
+
+    def handler(self, callback):
+        # callback is called with (key, event) from the pubsub thread
+        def handle(message):
+            key = message["channel"][len(self.channel_prefix) :]
+            callback(key, message["data"])
+
+        return handle
+
+    def watch(self, key, callback):
+        self.pubsub.subscribe(**{self.channel_prefix + key: self.handler(callback)})
+
+    def unwatch(self, key):
+        self.pubsub.unsubscribe(self.channel_prefix + key)
+
+    def watch_pattern(self, pattern, callback):
+        self.pubsub.psubscribe(
+            **{self.channel_prefix + pattern: self.handler(callback)}
+        )
+
+    def unwatch_pattern(self, pattern):
+        self.pubsub.punsubscribe(self.channel_prefix + pattern)
+
+    def start(self):
+        # at least one key must be watched before starting
+        self.thread = self.pubsub.run_in_thread(sleep_time=0.001)
+
+    def stop(self):
+        if self.thread is not None:
+            self.thread.stop()
+
+
+class RefreshScheduler(object):
+    # merge invalidations per key into at most one refresh
+    # per interval (0 is next frame). invalidate may be
+    # called from the pubsub thread, callbacks run on the
+    # kivy main loop
+    def __init__(self, interval=0.1):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.events_received = 0
+        self.events_coalesced = 0
+        self.refreshes_executed = 0
+        self.trigger = Clock.create_trigger(self.flush, interval)
+
+    def invalidate(self, key, callback):
+        with self.lock:
+            self.events_received += 1
+            if key in self.pending:
+                self.events_coalesced += 1
+            self.pending[key] = callback
+        self.trigger()
+
+    def flush(self, dt):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for callback in pending.values():
+            self.refreshes_executed += 1
+            callback()
+
+    def stats(self):
+        return {
+            "events_received": self.events_received,
+            "events_coalesced": self.events_coalesced,
+            "refreshes_executed": self.refreshes_executed,
+        }
@@ -6,17 +6,19 @@
 
 import argparse
 import atexit
+import sys
+import collections
+import concurrent.futures
+import hashlib
+import io
 import threading
 import subprocess
 import time
 import attr
-import redis
-from lxml import etree
-import keli.slurp_gphoto2 as sg
-import pyudev
 import os
-from ma_cli import data_models
-import fold_ui.keyling as keyling
+from enn_ui.db_events import KeyspaceWatcher, RefreshScheduler
+from enn_ui.virtual_list import VirtualList
+from enn_ui.startup import connect, startup_status
 
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
@@ -26,10 +28,13 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.animation import Animation
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.image import Image
+from kivy.graphics.texture import Texture
 
-r_ip, r_port = data_models.service_connection()
-binary_r = redis.StrictRedis(host=r_ip, port=r_port)
-redis_conn = redis.StrictRedis(host=r_ip, port=r_port, decode_responses=True)
+# connections are made once by connect() when the app starts
+binary_r = None
+redis_conn = None
 
 
 @attr.s
@@ -37,6 +42,15 @@ class Device(object):
     connected = attr.ib(default=False)
     details = attr.ib(default=attr.Factory(dict))
     settings = attr.ib(default=attr.Factory(dict))
+    # last value successfully applied to the device per setting,
+    # only changed on the main loop. applied_generation counts
+    # resets so results of captures started before one are dropped
+    applied_settings = attr.ib(default=attr.Factory(dict))
+    applied_generation = attr.ib(default=0)
+
+    def reset_applied(self):
+        self.applied_settings.clear()
+        self.applied_generation += 1
 
     def settings_prefixed(self, prefix):
         settings = {}
@@ -47,6 +61,86 @@ class Device(object):
         return settings
 
 
+def apply_settings(device_class, details, settings, applied, cancel_event=None):
+    # apply settings in one session if the device class has
+    # set_settings(details, settings), see ChdkptpBatch,
+    # otherwise or if that session fails with one set_setting
+    # call each. empty values and values equal to the last
+    # applied value are skipped
+    #
+    # returns seconds spent per applied setting
+    changed = {k: v for k, v in settings.items() if v and applied.get(k) != v}
+    timings = {}
+    if not changed:
+        return timings
+    if hasattr(device_class, "set_settings"):
+        started = time.perf_counter()
+        try:
+            device_class.set_settings(details, changed)
+        except Exception as ex:
+            # none of the batch is known to be applied,
+            # each setting is tried again on its own below
+            print("settings: ", ex)
+        else:
+            applied.update(changed)
+            # one session, time is shared by its settings
+            elapsed = (time.perf_counter() - started) / len(changed)
+            return {k: elapsed for k in changed}
+    for setting, setting_value in changed.items():
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        started = time.perf_counter()
+        try:
+            device_class.set_setting(details, setting, setting_value)
+        except Exception as ex:
+            print("setting: ", ex)
+            continue
+        applied[setting] = setting_value
+        timings[setting] = time.perf_counter() - started
+    return timings
+
+
+class ChdkptpBatch(object):
+    # wraps a device class whose settings are the chdkptp
+    # calls of the reference scripts, such as
+    # -eluar set_zoom({zoom}), see enn-db and reference.xml.
+    # set_settings runs the calls of every changed setting
+    # in one chdkptp process instead of one per setting,
+    # anything else is passed to the wrapped class
+    def __init__(self, device_class, chdkptp="chdkptp", timeout=60):
+        self.device_class = device_class
+        self.chdkptp = chdkptp
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(self.device_class, name)
+
+    def connect_option(self, details):
+        # gphoto2 addresses look like usb:001,005
+        try:
+            bus, device = details["address"].split(":", 1)[1].split(",")
+        except (KeyError, AttributeError, IndexError, ValueError):
+            return None
+        return "-c-b={} -d={}".format(bus, device)
+
+    def set_settings(self, details, settings):
+        connect_option = self.connect_option(details)
+        templates = reference_cache.templates(details.get("scripts"))
+        calls = []
+        for setting, value in settings.items():
+            template = templates.get(setting, "")
+            if connect_option is not None and template.startswith("-e"):
+                calls.append(template.format_map({setting: value}))
+            else:
+                self.device_class.set_setting(details, setting, value)
+        if calls:
+            subprocess.run(
+                [self.chdkptp, connect_option] + calls,
+                check=True,
+                timeout=self.timeout,
+            )
+
+
 @attr.s
 class Conditional(object):
     name = attr.ib(default="")
@@ -58,37 +152,270 @@ class Conditional(object):
     # settings:pre:foo:<device?>:127.0.0.1:6379 #list of keyling scripts
     # settings:set:foo:<device?>:127.0.0.1:6379 #hash of key:values to set
     # settings:post:foo:<device?>:127.0.0.1:6379 #list of keyling scripts
+    #
+    # names of stored conditionals are indexed per device
+    # so loading does not need to scan the keyspace
+    # settings:index:<device?>:127.0.0.1:6379 #set of names
+    # settings:indexed:127.0.0.1:6379 #set of devices with an index
+    key_template = "settings:{step}:{name}:{device}:{host}:{port}"
+    index_template = "settings:index:{device}:{host}:{port}"
+    indexed_template = "settings:indexed:{host}:{port}"
+    # pre and post are lists, set is a hash
+    step_types = {"pre": list, "set": dict, "post": list}
+
+    @classmethod
+    def load_all(cls, device):
+        # every conditional of a device, all steps are fetched
+        # in one pipeline with the command matching their type
+        db_port = redis_conn.connection_pool.connection_kwargs["port"]
+        db_host = redis_conn.connection_pool.connection_kwargs["host"]
+        template_values = {"device": device, "host": db_host, "port": db_port}
+        indexed_key = cls.indexed_template.format_map(template_values)
+        index_key = cls.index_template.format_map(template_values)
+        index = redis_conn.pipeline(transaction=False)
+        index.sismember(indexed_key, device)
+        index.smembers(index_key)
+        indexed, names = index.execute()
+        if not indexed:
+            cls.backfill_index(template_values)
+            names = redis_conn.smembers(index_key)
+
+        conditionals = []
+        pipe = redis_conn.pipeline(transaction=False)
+        for name in names:
+            conditionals.append(cls(name=name, device=device))
+            for step, step_type in cls.step_types.items():
+                template_values.update({"name": name, "step": step})
+                step_key = cls.key_template.format_map(template_values)
+                if step_type is list:
+                    pipe.lrange(step_key, 0, -1)
+                else:
+                    pipe.hgetall(step_key)
+        results = iter(pipe.execute())
+
+        for conditional in conditionals:
+            for step in cls.step_types:
+                contents = next(results)
+                if contents:
+                    setattr(conditional, step + "_contents", contents)
+        return conditionals
+
+    @classmethod
+    def backfill_index(cls, template_values):
+        # conditionals stored before the index existed are
+        # found with one scan, once per device, and added
+        pattern = cls.key_template.format_map(dict(template_values, step="*", name="*"))
+        names = set()
+        for key in redis_conn.scan_iter(match=pattern):
+            _, step, name, *_ = key.split(":")
+            if step in cls.step_types:
+                names.add(name)
+        pipe = redis_conn.pipeline(transaction=True)
+        if names:
+            pipe.sadd(cls.index_template.format_map(template_values), *names)
+        pipe.sadd(
+            cls.indexed_template.format_map(template_values),
+            template_values["device"],
+        )
+        pipe.execute()
 
     def keys(self, remove_only=False):
+        # store or remove atomically, other clients never
+        # see a half written conditional
+        pipe = redis_conn.pipeline(transaction=True)
+        self.queue_keys(pipe, remove_only=remove_only)
+        try:
+            pipe.execute()
+        except Exception as ex:
+            print(ex)
+
+    @classmethod
+    def store_many(cls, conditionals, remove_only=False):
+        # store or remove conditionals of any devices
+        # in a single transaction
+        pipe = redis_conn.pipeline(transaction=True)
+        for conditional in conditionals:
+            conditional.queue_keys(pipe, remove_only=remove_only)
+        try:
+            pipe.execute()
+        except Exception as ex:
+            print(ex)
+
+    def queue_keys(self, pipe, remove_only=False):
         db_port = redis_conn.connection_pool.connection_kwargs["port"]
         db_host = redis_conn.connection_pool.connection_kwargs["host"]
-        self.key_template = "settings:{step}:{name}:{device}:{host}:{port}"
         template_values = {
             "name": self.name,
             "device": self.device,
             "host": db_host,
             "port": db_port,
         }
-        for step in ["pre", "set", "post"]:
+        for step, step_type in self.step_types.items():
             template_values.update({"step": step})
             key_name = self.key_template.format_map(template_values)
             contents = getattr(self, step + "_contents")
-            redis_conn.delete(key_name)
-            if not remove_only:
-                if isinstance(contents, list):
-                    # only write nonempty values
-                    if contents:
-                        try:
-                            redis_conn.lpush(key_name, *contents)
-                        except Exception as ex:
-                            print(ex)
-                elif isinstance(contents, dict):
-                    # only write nonempty values
-                    if contents:
-                        try:
-                            redis_conn.hmset(key_name, contents)
-                        except Exception as ex:
-                            print(ex)
+            pipe.delete(key_name)
+            # only write nonempty values
+            if not remove_only and contents:
+                if step_type is list:
+                    pipe.lpush(key_name, *contents)
+                else:
+                    pipe.hmset(key_name, contents)
+        index_key = self.index_template.format_map(template_values)
+        if remove_only:
+            pipe.srem(index_key, self.name)
+        else:
+            pipe.sadd(index_key, self.name)
+
+
+class KeylingEngine(object):
+    # evaluates conditionals against an env hash. compiled
+    # keyling models are cached by content hash, the least
+    # recently used are evicted past maxsize
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.models = collections.OrderedDict()
+        self.compiled = 0
+        self.hits = 0
+
+    def model(self, text):
+        digest = hashlib.sha1(text.encode()).hexdigest()
+        if digest in self.models:
+            self.models.move_to_end(digest)
+            self.hits += 1
+            return self.models[digest]
+        import fold_ui.keyling as keyling
+
+        model = keyling.model(text)
+        self.compiled += 1
+        self.models[digest] = model
+        if len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+        return model
+
+    def conditions_met(self, conditional, env):
+        # every pre script must pass against a copy of the env,
+        # parse_lines returns a falsy value if conditions fail
+        if not conditional.pre_contents:
+            return False
+        import fold_ui.keyling as keyling
+
+        for text in conditional.pre_contents:
+            try:
+                if not keyling.parse_lines(self.model(text), dict(env), env):
+                    return False
+            except Exception as ex:
+                print("keyling: ", ex)
+                return False
+        return True
+
+    def evaluate(self, conditionals, env):
+        # merged set_contents of conditionals whose conditions are met
+        settings = {}
+        for conditional in conditionals:
+            if self.conditions_met(conditional, env):
+                settings.update(conditional.set_contents)
+        return settings
+
+
+keyling_engine = KeylingEngine()
+
+
+class ReferenceCache(object):
+    # device:script_lookup and scripts:{name} only change
+    # when enn-db runs. they are read once and shared by
+    # every DeviceItem, invalidate is called from keyspace
+    # notifications on those keys
+    lookup_key = "device:script_lookup"
+    script_key_prefix = "scripts:"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lookup = None
+        self.scripts = {}
+        self.reads = 0
+
+    def script_for(self, device_name):
+        with self.lock:
+            if self.lookup is None:
+                self.lookup = redis_conn.hgetall(self.lookup_key)
+                self.reads += 1
+            return self.lookup.get(device_name)
+
+    def templates(self, script):
+        # setting name -> call template, shared, do not modify
+        with self.lock:
+            if script not in self.scripts:
+                self.scripts[script] = redis_conn.hgetall(
+                    self.script_key_prefix + str(script)
+                )
+                self.reads += 1
+            return self.scripts[script]
+
+    def attributes(self, script):
+        return list(self.templates(script))
+
+    def invalidate(self, key):
+        with self.lock:
+            if key == self.lookup_key:
+                self.lookup = None
+            elif key.startswith(self.script_key_prefix):
+                self.scripts.pop(key[len(self.script_key_prefix) :], None)
+
+
+reference_cache = ReferenceCache()
+
+
+class ThumbnailCache(object):
+    # downscaled rgb thumbnails of slurped binaries keyed by
+    # glworb, the least recently used are evicted once the
+    # cache holds more than max_bytes of pixels
+    def __init__(self, size=(320, 240), max_bytes=64 * 1024 * 1024):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.thumbnails = collections.OrderedDict()
+        self.bytes = 0
+
+    def get(self, glworb):
+        with self.lock:
+            if glworb in self.thumbnails:
+                self.thumbnails.move_to_end(glworb)
+                return self.thumbnails[glworb]
+        return None
+
+    def put(self, glworb, thumbnail):
+        with self.lock:
+            if glworb in self.thumbnails:
+                return
+            self.thumbnails[glworb] = thumbnail
+            self.bytes += len(thumbnail[1])
+            while self.bytes > self.max_bytes and len(self.thumbnails) > 1:
+                _, (_, pixels) = self.thumbnails.popitem(last=False)
+                self.bytes -= len(pixels)
+
+    def load(self, glworb):
+        # called from worker threads, returns ((width, height), rgb bytes)
+        thumbnail = self.get(glworb)
+        if thumbnail is not None:
+            return thumbnail
+        binary_key = redis_conn.hget(glworb, "binary_key")
+        if binary_key is None:
+            return None
+        from PIL import Image as PILImage
+
+        # BytesIO shares the fetched blob instead of copying it
+        image = PILImage.open(io.BytesIO(binary_r.get(binary_key)))
+        # let jpeg decode at a reduced scale
+        image.draft("RGB", self.size)
+        image.thumbnail(self.size)
+        image = image.convert("RGB")
+        thumbnail = (image.size, image.tobytes())
+        self.put(glworb, thumbnail)
+        return thumbnail
+
+
+thumbnail_cache = ThumbnailCache()
 
 
 class ConditionItem(BoxLayout):
@@ -144,6 +471,19 @@ class ConditionItem(BoxLayout):
         self.post_input.text = ""
         if self.conditional.post_contents:
             self.post_input.text = self.conditional.post_contents[0]
+        self.stored_texts = self.input_texts()
+
+    def input_texts(self):
+        return (
+            self.name_input.text,
+            self.env_input.text,
+            self.set_input.text,
+            self.post_input.text,
+        )
+
+    def edited(self):
+        # inputs changed since last loaded or stored
+        return self.input_texts() != getattr(self, "stored_texts", None)
 
     def update(self):
         self.env_container.clear_widgets()
@@ -179,12 +519,13 @@ class ConditionItem(BoxLayout):
             self.post_input.text, set_on_valid="post_contents", widget=self.post_input
         )
         self.conditional.keys()
+        self.stored_texts = self.input_texts()
 
     def validate_keyling(self, text, set_on_valid=None, widget=None):
         current_background = [1, 1, 1, 1]
         try:
-            # validate model
-            keyling.model(text)
+            # validate model, compiled once and cached
+            keyling_engine.model(text)
             if widget:
                 anim = Animation(
                     background_color=[0, 1, 0, 1], duration=0.5
@@ -234,6 +575,38 @@ class ConditionItem(BoxLayout):
                 anim.start(widget)
 
 
+class SettingRow(RecycleDataViewBehavior, BoxLayout):
+    # row of the virtual settings list, data is
+    # {"attribute", "value", "on_set"}
+    def __init__(self, **kwargs):
+        super(SettingRow, self).__init__(**kwargs)
+        self.row_data = {}
+        self.key_label = Label()
+        self.value_input = TextInput(multiline=False)
+        self.value_input.bind(text=lambda widget, text: self.on_value(text))
+        self.value_input.bind(
+            on_text_validate=lambda widget: self.row_data["on_set"](
+                self.row_data["attribute"], widget.text, widget
+            )
+        )
+        self.add_widget(self.key_label)
+        self.add_widget(self.value_input)
+
+    def on_value(self, text):
+        # rows are reused, so typed values are kept in
+        # the data and passed on without validation the
+        # same way preview reads settings_widgets
+        if self.row_data and self.row_data["value"] != text:
+            self.row_data["value"] = text
+            self.row_data["on_set"](self.row_data["attribute"], text)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.row_data = {}
+        self.key_label.text = str(data["attribute"])
+        self.value_input.text = str(data["value"])
+        self.row_data = data
+
+
 class DeviceItem(BoxLayout):
     def __init__(self, *args, app=None, **kwargs):
         self.orientation = "vertical"
@@ -248,9 +621,38 @@ class DeviceItem(BoxLayout):
         self.conditions_container = BoxLayout(
             orientation="vertical", size_hint_y=None, height=1000, minimum_height=200
         )
+        self.conditions_base_height = self.conditions_container.height
         self.conditions_frame = BoxLayout(orientation="horizontal")
         self.settings_widgets = []
         self.conditional_widgets = []
+        self.conditionals = []
+        self.settings_list = None
+        if self.app.kwargs["virtual_lists"]:
+            self.settings_list = VirtualList(SettingRow)
+        # device calls run one at a time in a worker
+        # thread so the ui does not block on the camera
+        self.worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.preview_future = None
+        # cancel event of every queued or running job, a
+        # new job never clears the event of an earlier one
+        self.cancel_events = {}
+        self.progress_text = ""
+        # details are refreshed in sections, each
+        # only when invalidated, see refresh()
+        self.info_container = BoxLayout(orientation="vertical", size_hint_y=None)
+        self.settings_container = BoxLayout(orientation="vertical")
+        if self.settings_list is None:
+            self.settings_container.size_hint_y = None
+        self.sections = collections.OrderedDict(
+            [
+                ("status", self.refresh_status),
+                ("details", self.refresh_details),
+                ("settings", self.refresh_settings),
+                ("conditionals", self.update_conditions),
+            ]
+        )
+        self.dirty = set(self.sections)
+        self.build_controls()
         self.add_widget(self.details_container)
         create_condition_button = Button(text="new\ncond", width=60, size_hint_x=None)
         create_condition_button.bind(on_press=lambda widget: self.add_conditional())
@@ -262,46 +664,36 @@ class DeviceItem(BoxLayout):
         self.add_widget(self.conditions_frame)
 
     def update_conditions(self):
+        conditionals = Conditional.load_all(self.device.details["uid"])
+        # stored conditionals, evaluated on env changes
+        self.conditionals = conditionals
+        found = {conditional.name for conditional in conditionals}
+
+        # keep conditionals that have not been stored yet and
+        # unsaved edits of stored ones, update_conditions also
+        # runs on db events
+        unstored = []
+        stored = {}
+        for c in self.conditions_container.children:
+            if c.conditional.name in found:
+                stored[c.conditional.name] = c
+            else:
+                unstored.append(c)
         self.conditions_container.clear_widgets()
-        db_port = redis_conn.connection_pool.connection_kwargs["port"]
-        db_host = redis_conn.connection_pool.connection_kwargs["host"]
-        key_template = "settings:{step}:{name}:{device}:{host}:{port}"
-        template_values = {
-            "name": "*",
-            "device": self.device.details["uid"],
-            "host": db_host,
-            "port": db_port,
-        }
-
-        found = {}
-        for step in ["pre", "set", "post"]:
-            template_values.update({"step": step})
-            pattern = key_template.format_map(template_values)
-            print(pattern)
-            for found_keys in redis_conn.scan_iter(match=pattern):
-                _, _, name, uid, _, _ = found_keys.split(":")
-                if name not in found:
-                    found[name] = {}
-                found[name][step] = found_keys
-
-        for conditional_name, step in found.items():
-            c = ConditionItem()
-            c.conditional.device = self.device.details["uid"]
-            c.parent_device = self
-            c.conditional.name = conditional_name
-            for step_name, step_key in step.items():
-                contents = None
-                try:
-                    contents = redis_conn.lrange(step_key, 0, -1)
-                except Exception as ex:
-                    try:
-                        contents = redis_conn.hgetall(step_key)
-                    except Exception as ex:
-                        pass
-                if contents:
-                    setattr(c.conditional, "{}_contents".format(step_name), contents)
+        self.conditions_container.height = self.conditions_base_height
+        for c in reversed(unstored):
+            self.add_conditional(c)
 
-            c.update_from_conditional()
+        for conditional in conditionals:
+            c = stored.get(conditional.name)
+            if c is None:
+                c = ConditionItem()
+                c.parent_device = self
+                c.conditional = conditional
+                c.update_from_conditional()
+            elif not c.edited():
+                c.conditional = conditional
+                c.update_from_conditional()
             self.add_conditional(c)
 
     def add_conditional(self, conditional=None):
@@ -313,85 +705,30 @@ class DeviceItem(BoxLayout):
         self.conditions_container.parent.scroll_to(conditional)
         self.conditions_container.height += conditional.height
 
-    def update_details(self):
-        self.details_container.clear_widgets()
-        self.settings_widgets = []
-        connected_color = [.5, .5, .5, 1]
-        connected_text = "not connected"
-        if self.device.connected:
-            connected_color = [0, 1, 0, 1]
-            connected_text = "connected"
+    def build_controls(self):
+        # status row and controls are built once, refresh_status
+        # only changes the colors and text of the status row
         status_row = BoxLayout()
-        connected_button = Button(
-            text=connected_text,
-            background_color=connected_color,
-            height=30,
-            size_hint_y=None,
-        )
-        connected_button.bind(on_press=lambda widget: self.app.update_devices())
+        self.connected_button = Button(height=30, size_hint_y=None)
+        self.connected_button.bind(on_press=lambda widget: self.app.update_devices())
         remove_button = Button(text="clear", height=30, size_hint_y=None)
-        remove_button.bind(on_press=lambda widget: [self.parent.remove_widget(self)])
-        status_row.add_widget(connected_button)
+        remove_button.bind(on_press=lambda widget: self.app.remove_device(self))
+        status_row.add_widget(self.connected_button)
         status_row.add_widget(remove_button)
-        self.details_container.add_widget(status_row)
-
-        # device information
-        for k, v in self.device.details.items():
-            row = BoxLayout(height=30, size_hint_y=None)
-            key = Label(text=str(k))
-            value = Label(text=str(v))
-            row.add_widget(key)
-            row.add_widget(value)
-            self.details_container.add_widget(row)
-
-        # add adjustable values from the db
-        # the db material is generated from xml
-        # see enn-db and reference.xml
-        try:
-            # incorrect keys will be stored/reloaded from xml
-            if "scripts" not in self.device.details:
-                self.device.details["scripts"] = redis_conn.hget(
-                    "device:script_lookup", self.device.details["name"]
-                )
-
-            reference = redis_conn.hgetall(
-                "scripts:{}".format(self.device.details["scripts"])
-            )
-            for attribute, _ in reference.items():
-                row = BoxLayout(height=30, size_hint_y=None)
-                key = Label(text=str(attribute))
-                value = TextInput(multiline=False)
-                try:
-                    value.text = self.device.settings[attribute]
-                except KeyError as ex:
-                    print(ex)
-                    pass
-                value.bind(
-                    on_text_validate=lambda widget, attribute=attribute: self.set_device_setting(
-                        attribute, widget.text, widget
-                    )
-                )
-                # store to get set_device_setting before preview
-                value.attribute = attribute
-                self.settings_widgets.append(value)
-                row.add_widget(key)
-                row.add_widget(value)
-                self.details_container.add_widget(row)
-        except Exception as ex:
-            print(ex)
 
         # preview
         self.view_call_input = TextInput(
             text=self.default_view_call, multiline=False, height=30, size_hint_y=None
         )
         self.view_call_input.bind(on_text_validate=lambda widget: self.check_call())
-        preview_button = Button(
-            text="preview",
-            background_color=connected_color,
-            height=60,
-            size_hint_y=None,
-        )
-        preview_button.bind(on_press=lambda widget: self.preview())
+        self.preview_button = Button(text="preview", height=60, size_hint_y=None)
+        self.preview_button.bind(on_press=lambda widget: self.preview())
+        progress_row = BoxLayout(height=30, size_hint_y=None)
+        self.progress_label = Label(text=self.progress_text)
+        cancel_button = Button(text="cancel", width=80, size_hint_x=None)
+        cancel_button.bind(on_press=lambda widget: self.cancel())
+        progress_row.add_widget(self.progress_label)
+        progress_row.add_widget(cancel_button)
 
         get_state_button = Button(text="get state", height=30, size_hint_y=None)
         set_state_button = Button(text="set state", height=30, size_hint_y=None)
@@ -412,13 +749,131 @@ class DeviceItem(BoxLayout):
         )
         get_set_state_row.add_widget(get_state_button)
         get_set_state_row.add_widget(set_state_button)
-        self.details_container.add_widget(get_set_state_row)
         load_state_from_row.add_widget(load_state_from_button)
         load_state_from_row.add_widget(load_state_from_input)
+
+        self.details_container.add_widget(status_row)
+        self.details_container.add_widget(self.info_container)
+        self.details_container.add_widget(self.settings_container)
+        self.details_container.add_widget(get_set_state_row)
         self.details_container.add_widget(load_state_from_row)
         self.details_container.add_widget(self.view_call_input)
-        self.details_container.add_widget(preview_button)
-        self.update_conditions()
+        self.details_container.add_widget(self.preview_button)
+        self.details_container.add_widget(progress_row)
+        if self.app.kwargs["preview_mode"] == "pane":
+            self.captures = []
+            self.capture_index = 0
+            self.preview_image = Image(height=200, size_hint_y=None)
+            capture_row = BoxLayout(height=30, size_hint_y=None)
+            previous_button = Button(text="<", width=40, size_hint_x=None)
+            previous_button.bind(on_press=lambda widget: self.show_capture(-1))
+            next_button = Button(text=">", width=40, size_hint_x=None)
+            next_button.bind(on_press=lambda widget: self.show_capture(1))
+            self.preview_label = Label(text="")
+            capture_row.add_widget(previous_button)
+            capture_row.add_widget(self.preview_label)
+            capture_row.add_widget(next_button)
+            self.details_container.add_widget(self.preview_image)
+            self.details_container.add_widget(capture_row)
+
+    def invalidate(self, *sections):
+        # mark sections for the next refresh(), all if none given
+        self.dirty.update(sections or self.sections)
+
+    def refresh(self):
+        for section, refresh_section in self.sections.items():
+            if section in self.dirty:
+                self.dirty.discard(section)
+                refresh_section()
+
+    def update_details(self):
+        self.invalidate()
+        self.refresh()
+
+    def refresh_status(self):
+        connected_color = [.5, .5, .5, 1]
+        connected_text = "not connected"
+        if self.device.connected:
+            connected_color = [0, 1, 0, 1]
+            connected_text = "connected"
+        self.connected_button.text = connected_text
+        self.connected_button.background_color = connected_color
+        self.preview_button.background_color = connected_color
+
+    def refresh_details(self):
+        # device information
+        self.info_container.clear_widgets()
+        for k, v in self.device.details.items():
+            row = BoxLayout(height=30, size_hint_y=None)
+            key = Label(text=str(k))
+            value = Label(text=str(v))
+            row.add_widget(key)
+            row.add_widget(value)
+            self.info_container.add_widget(row)
+        self.info_container.height = 30 * len(self.info_container.children)
+
+    def refresh_settings(self):
+        self.settings_container.clear_widgets()
+        self.settings_widgets = []
+        # add adjustable values from the db
+        # the db material is generated from xml
+        # see enn-db and reference.xml
+        try:
+            # incorrect keys will be stored/reloaded from xml
+            if "scripts" not in self.device.details:
+                self.device.details["scripts"] = reference_cache.script_for(
+                    self.device.details["name"]
+                )
+
+            reference = reference_cache.attributes(self.device.details["scripts"])
+            if self.settings_list is not None:
+                self.settings_list.data = [
+                    {
+                        "attribute": attribute,
+                        "value": self.device.settings.get(attribute, ""),
+                        "on_set": self.set_device_setting,
+                    }
+                    for attribute in reference
+                ]
+                self.settings_container.add_widget(self.settings_list)
+            else:
+                for attribute in reference:
+                    self.settings_container.add_widget(self.setting_row(attribute))
+        except Exception as ex:
+            print(ex)
+        if self.settings_list is None:
+            self.settings_container.height = 30 * len(self.settings_container.children)
+
+    def setting_row(self, attribute):
+        row = BoxLayout(height=30, size_hint_y=None)
+        key = Label(text=str(attribute))
+        value = TextInput(multiline=False)
+        try:
+            value.text = self.device.settings[attribute]
+        except KeyError as ex:
+            print(ex)
+            pass
+        value.bind(
+            on_text_validate=lambda widget, attribute=attribute: self.set_device_setting(
+                attribute, widget.text, widget
+            )
+        )
+        # store to get set_device_setting before preview
+        value.attribute = attribute
+        self.settings_widgets.append(value)
+        row.add_widget(key)
+        row.add_widget(value)
+        return row
+
+    def apply_conditionals(self, env):
+        settings = keyling_engine.evaluate(self.conditionals, env)
+        changed = {
+            k: v for k, v in settings.items() if self.device.settings.get(k) != v
+        }
+        if changed:
+            self.device.settings.update(changed)
+            self.invalidate("settings")
+            self.refresh()
 
     def get_state(self):
         state = redis_conn.hgetall(
@@ -428,7 +883,8 @@ class DeviceItem(BoxLayout):
             self.device.settings = state
         else:
             self.device.settings = {}
-        self.update_details()
+        self.invalidate("settings")
+        self.refresh()
 
     def set_state(self):
         redis_conn.hmset(
@@ -449,7 +905,8 @@ class DeviceItem(BoxLayout):
                     if k.startswith(self.setting_prefix):
                         # remove prefix before adding
                         self.device.settings[k[len(self.setting_prefix) :]] = v
-                self.update_details()
+                self.invalidate("settings")
+                self.refresh()
         except KeyError:
             pass
 
@@ -466,57 +923,242 @@ class DeviceItem(BoxLayout):
         if not self.view_call_input.text:
             self.view_call_input.text = self.default_view_call
 
-    def preview(self, settings=None):
+    def set_progress(self, text):
+        self.progress_text = text
+        self.progress_label.text = text
+
+    def report_progress(self, text):
+        # callable from worker threads
+        Clock.schedule_once(lambda dt: self.set_progress(text))
+
+    def cancel(self):
+        # queued previews are dropped, a running preview
+        # stops before its next device call
+        for future, cancel_event in self.cancel_events.items():
+            cancel_event.set()
+            future.cancel()
+
+    def capture(self, settings=None, barrier=None, on_done=None, discovered=None):
+        # queue settings, rediscovery and slurp on the device
+        # worker, on_done(future) is called on the main loop.
+        # discovered skips rediscovery in the worker, see
+        # DevApp.capture_all
         if settings is None:
             for widget in self.settings_widgets:
                 self.set_device_setting(widget.attribute, widget.text, widget)
             settings = self.device.settings
-        # apply settings
-        for setting, setting_value in settings.items():
-            if setting_value:
-                print(setting, setting_value, self.device.details)
-                try:
-                    self.app.device_classes[
-                        self.device.details["discovery"]
-                    ].set_setting(self.device.details, setting, setting_value)
-                except Exception as ex:
-                    print("setting: ", ex)
-        # call may result in: [-108] File not found
-        # if usb address has changed
-        #
-        # update devices again before calling
-        self.app.update_devices()
-        metadata = self.device.settings_prefixed(self.setting_prefix)
-        slurped = self.app.device_classes[self.device.details["discovery"]].slurp(
-            device=self.device.details, metadata=metadata
+        cancel_event = threading.Event()
+        self.set_progress("queued")
+        self.preview_future = self.worker.submit(
+            self.capture_job,
+            self.app.device_classes[self.device.details["discovery"]],
+            dict(self.device.details),
+            dict(settings),
+            dict(self.device.applied_settings),
+            self.device.settings_prefixed(self.setting_prefix),
+            cancel_event,
+            barrier,
+            discovered,
+        )
+        self.cancel_events[self.preview_future] = cancel_event
+        generation = self.device.applied_generation
+        self.preview_future.add_done_callback(
+            lambda future: Clock.schedule_once(
+                lambda dt: self.job_done(future, generation, on_done)
+            )
         )
+        return self.preview_future
+
+    def job_done(self, future, generation, on_done=None):
+        self.cancel_events.pop(future, None)
+        self.merge_applied(future, generation)
+        if on_done is not None:
+            on_done(future)
 
+    def preview(self, settings=None):
         view_call = self.view_call_input.text
-        for thing in slurped:
-            call_dict = {
-                "host": self.app.db_host,
-                "port": self.app.db_port,
-                "thing": thing,
-                "thing_field": "binary_key",
-            }
-            view_call = view_call.format_map(call_dict)
-            subprocess.Popen(view_call.split(" "))
+        self.capture(
+            settings=settings,
+            on_done=lambda future: self.preview_done(future, view_call),
+        )
+
+    def capture_job(
+        self,
+        device_class,
+        details,
+        settings,
+        applied,
+        metadata,
+        cancel_event,
+        barrier=None,
+        discovered=None,
+    ):
+        # runs in the device worker thread, only touches
+        # copies of device state. applied values are
+        # returned and merged on the main loop
+        #
+        # if a barrier is given, slurp waits for every
+        # other device sharing it to be ready
+        try:
+            self.report_progress("applying settings")
+            setting_seconds = apply_settings(
+                device_class,
+                details,
+                settings,
+                applied,
+                cancel_event=cancel_event,
+            )
+            if cancel_event.is_set():
+                raise concurrent.futures.CancelledError()
+            # call may result in: [-108] File not found
+            # if usb address has changed
+            #
+            # discover again before calling
+            if discovered is None:
+                self.report_progress("discovering")
+                discovered = device_class.discover()
+            reset = False
+            for device in discovered:
+                if device["uid"] == details["uid"]:
+                    if any(details.get(k) != v for k, v in device.items()):
+                        # address changed, settings may not have been kept
+                        reset = True
+                    details.update(device)
+            if cancel_event.is_set():
+                raise concurrent.futures.CancelledError()
+        except BaseException:
+            # do not leave other devices waiting
+            if barrier is not None:
+                barrier.abort()
+            raise
+
+        if barrier is not None:
+            self.report_progress("waiting")
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                # another device failed, slurp unsynchronized
+                pass
+            if cancel_event.is_set():
+                raise concurrent.futures.CancelledError()
+        self.report_progress("slurping")
+        triggered = time.perf_counter()
+        slurped = device_class.slurp(device=details, metadata=metadata)
+        return {
+            "details": details,
+            "applied": applied,
+            "reset": reset,
+            "slurped": slurped,
+            "setting_seconds": setting_seconds,
+            "triggered": triggered,
+            "finished": time.perf_counter(),
+        }
+
+    def merge_applied(self, future, generation):
+        # applied values of a finished capture, dropped if the
+        # device was reset while it ran or the capture failed
+        if future.cancelled() or future.exception() is not None:
+            return
+        if generation != self.device.applied_generation:
+            return
+        result = future.result()
+        if result["reset"]:
+            self.device.reset_applied()
+        else:
+            self.device.applied_settings.update(result["applied"])
+
+    def capture_done(self, future):
+        # returns the capture result or None
+        if future.cancelled():
+            self.set_progress("cancelled")
+            return None
+        try:
+            result = future.result()
+        except concurrent.futures.CancelledError:
+            self.set_progress("cancelled")
+            return None
+        except Exception as ex:
+            print("capture: ", ex)
+            self.set_progress("failed")
+            return None
+        # address may have changed
+        self.device.details.update(result["details"])
+        self.set_progress(
+            "slurped {} after {} settings in {:.2f}s".format(
+                len(result["slurped"]),
+                len(result["setting_seconds"]),
+                sum(result["setting_seconds"].values()),
+            )
+        )
+        return result
+
+    def preview_done(self, future, view_call):
+        result = self.capture_done(future)
+        if result is None:
+            return
+        for thing in result["slurped"]:
+            self.app.view(thing, view_call, device_widget=self)
+
+    def show_thing(self, thing):
+        # in process preview of a slurped thing, decoded
+        # and downscaled off the ui thread
+        self.captures.append(thing)
+        self.capture_index = len(self.captures) - 1
+        self.show_capture(0)
+
+    def show_capture(self, step):
+        # step through the captures of this session
+        if not self.captures:
+            return
+        self.capture_index = max(
+            0, min(len(self.captures) - 1, self.capture_index + step)
+        )
+        thing = self.captures[self.capture_index]
+        self.preview_label.text = "{}/{} {}".format(
+            self.capture_index + 1, len(self.captures), thing
+        )
+        future = self.app.thumbnail_pool.submit(thumbnail_cache.load, thing)
+        future.add_done_callback(
+            lambda future: Clock.schedule_once(
+                lambda dt: self.show_thumbnail(thing, future)
+            )
+        )
+
+    def show_thumbnail(self, thing, future):
+        # stepped to another capture while decoding
+        if self.captures[self.capture_index] != thing:
+            return
+        try:
+            thumbnail = future.result()
+        except Exception as ex:
+            print("preview: ", ex)
+            return
+        if thumbnail is None:
+            return
+        size, pixels = thumbnail
+        texture = Texture.create(size=size, colorfmt="rgb")
+        texture.blit_buffer(pixels, colorfmt="rgb", bufferfmt="ubyte")
+        texture.flip_vertical()
+        self.preview_image.texture = texture
 
 
 class DevApp(App):
     def __init__(self, *args, **kwargs):
         # store kwargs to passthrough
         self.kwargs = kwargs
-        if kwargs["db_host"] and kwargs["db_port"]:
-            global binary_r
-            global redis_conn
-            db_settings = {"host": kwargs["db_host"], "port": kwargs["db_port"]}
-            binary_r = redis.StrictRedis(**db_settings)
-            redis_conn = redis.StrictRedis(**db_settings, decode_responses=True)
+        global binary_r
+        global redis_conn
+        binary_r, redis_conn = connect(kwargs["db_host"], kwargs["db_port"])
+        self.exit_status = 0
 
         self.db_port = redis_conn.connection_pool.connection_kwargs["port"]
         self.db_host = redis_conn.connection_pool.connection_kwargs["host"]
         self.env_key = "machinic:env:{}:{}".format(self.db_host, self.db_port)
+        # hash and channel holding the latest previewed thing
+        self.preview_key = "enn:preview:{}:{}".format(self.db_host, self.db_port)
+        self.viewers = {}
+        # decodes thumbnails for preview panes
+        self.thumbnail_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
         self.session_save_path = "~/.config/enn-ui/"
         self.session_save_filename = "session_{}_{}.xml".format(
             self.db_host, self.db_port
@@ -525,35 +1167,64 @@ class DevApp(App):
         super(DevApp, self).__init__()
 
     def build(self):
-        root = BoxLayout()
+        root = BoxLayout(orientation="vertical")
+        toolbar = BoxLayout(height=30, size_hint_y=None)
+        capture_all_button = Button(text="capture all", width=120, size_hint_x=None)
+        capture_all_button.bind(on_press=lambda widget: self.capture_all())
+        self.capture_stats_label = Label(text="")
+        toolbar.add_widget(capture_all_button)
+        toolbar.add_widget(self.capture_stats_label)
+        root.add_widget(toolbar)
+        self.capture_stats = {}
+        # uid -> DeviceItem for every device in device_container
+        self.devices_by_uid = {}
         self.device_container = BoxLayout()
         empty_notice_widget = Label(text="no devices. plug something in")
         self.device_container.empty_notice = empty_notice_widget
         root.add_widget(self.device_container)
+        # only subscribe to the env hash and the conditionals
+        # of devices in device_container, see add_device
+        self.db_events = KeyspaceWatcher(redis_conn)
+        self.refresh = RefreshScheduler(interval=self.kwargs["refresh_interval"])
+        self.db_events.watch(self.env_key, self.handle_db_events)
+        # reference data is cached until enn-db changes it
+        self.db_events.watch(ReferenceCache.lookup_key, self.handle_reference_events)
+        self.db_events.watch_pattern(
+            ReferenceCache.script_key_prefix + "*", self.handle_reference_events
+        )
         self.update_env_values()
         self.load_session()
         # classes for device discovery and interaction
         # .discover() is called for discovery
+        import keli.slurp_gphoto2 as sg
+
         self.device_classes = {}
         self.device_classes["gphoto2"] = sg.SlurpGphoto2(
             binary_r=binary_r, redis_conn=redis_conn
         )
+        if self.kwargs["chdkptp_batch"]:
+            self.device_classes["gphoto2"] = ChdkptpBatch(
+                self.device_classes["gphoto2"]
+            )
 
-        self.db_event_subscription = redis_conn.pubsub()
-        self.db_event_subscription.psubscribe(
-            **{"__keyspace@0__:*": self.handle_db_events}
-        )
-        # add thread to pubsub object to stop() on exit
-        self.db_event_subscription.thread = self.db_event_subscription.run_in_thread(
-            sleep_time=0.001
-        )
+        self.db_events.start()
         # monitor usb events to show local device connect / disconnect
         # there may be other sources that are accessible over the
         # db or network
-        usb_event_thread = threading.Thread(target=self.usb_events)
-        # end thread when window is closed
-        usb_event_thread.daemon = True
-        usb_event_thread.start()
+        #
+        # bursts of events (a hub, a camera with several
+        # interfaces) are merged into one discovery pass
+        self.usb_event_count = 0
+        self.discovery_count = 0
+        self.discovery_trigger = Clock.create_trigger(
+            lambda dt: self.update_devices(), self.kwargs["usb_settle"]
+        )
+        self.discovery_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.device_classes)
+        )
+        self.discovery_futures = []
+        self.discovery_pending = False
+        self.usb_events()
         self.update_devices()
         self.placeholder()
         return root
@@ -565,59 +1236,313 @@ class DevApp(App):
             self.device_container.add_widget(self.device_container.empty_notice)
 
     def usb_events(self):
+        import pyudev
+
         context = pyudev.Context()
         monitor = pyudev.Monitor.from_netlink(context)
-
-        def log_event(action, device):
-            print("action: {} device: {}".format(action, device))
-            if action in ("add", "remove"):
-                Clock.schedule_once(lambda dt: self.update_devices(), .01)
-
-        observer = pyudev.MonitorObserver(monitor, log_event)
-        observer.start()
-        # loop since this will be run in a thread
-        while True:
-            time.sleep(0.1)
+        # whole usb devices only, not their interfaces
+        # or any other subsystem
+        monitor.filter_by(subsystem="usb", device_type="usb_device")
+        # vendor ids as hex strings, such as 04a9
+        usb_vendors = {int(vendor, 16) for vendor in self.kwargs["usb_vendor"] or []}
+
+        def log_event(device):
+            if device.action not in ("add", "remove"):
+                return
+            # PRODUCT is vendor/product/revision in hex
+            vendor = device.get("PRODUCT", "").split("/")[0]
+            if usb_vendors and (not vendor or int(vendor, 16) not in usb_vendors):
+                return
+            self.usb_event_count += 1
+            print("action: {} device: {}".format(device.action, device))
+            self.discovery_trigger()
+
+        # observer runs in its own daemon thread
+        self.usb_observer = pyudev.MonitorObserver(monitor, callback=log_event)
+        self.usb_observer.start()
 
     def update_devices(self):
+        # discover() runs in discovery_pool, reconcile_devices
+        # runs on the main loop once every class has finished
+        if self.discovery_futures:
+            self.discovery_pending = True
+            return
+        self.discovery_count += 1
+        print(
+            "discovery: {} usb events: {}".format(
+                self.discovery_count, self.usb_event_count
+            )
+        )
+        self.discovery_futures = [
+            self.discovery_pool.submit(device_class.discover)
+            for device_class in self.device_classes.values()
+        ]
+        for future in self.discovery_futures:
+            future.add_done_callback(
+                lambda future: Clock.schedule_once(lambda dt: self.discovery_done())
+            )
+
+    def discovery_done(self):
+        # scheduled once per future, only the first call
+        # after every future is done reconciles
+        if not self.discovery_futures:
+            return
+        if not all(future.done() for future in self.discovery_futures):
+            return
         discovered = []
+        for future in self.discovery_futures:
+            try:
+                discovered.extend(future.result())
+            except Exception as ex:
+                print("discovery: ", ex)
+        self.discovery_futures = []
+        self.reconcile_devices(discovered)
+        # events that arrived during discovery
+        if self.discovery_pending:
+            self.discovery_pending = False
+            self.update_devices()
+
+    def reconcile_devices(self, discovered):
         self.device_container.remove_widget(self.device_container.empty_notice)
-
-        for name, device_class in self.device_classes.items():
-            discovered.extend(device_class.discover())
-
-        # reset existing device connected status
-        # before rediscovery / nondiscovery
-        for child in self.device_container.children:
-            child.device.connected = False
-            child.update_details()
-
-        for device in discovered:
-            if not device["uid"] in [
-                child.device.details["uid"] for child in self.device_container.children
-            ]:
+        discovered_by_uid = {device["uid"]: device for device in discovered}
+
+        # only devices whose connected status or details
+        # changed are updated
+        for uid, device_widget in self.devices_by_uid.items():
+            device = discovered_by_uid.get(uid)
+            connected = device is not None
+            details = device_widget.device.details
+            if connected:
+                # update details since address may have changed
+                details = dict(details)
+                details.update(device)
+            if connected != device_widget.device.connected:
+                device_widget.invalidate("status")
+            if details != device_widget.device.details:
+                device_widget.invalidate("details")
+                if details.get("name") != device_widget.device.details.get("name"):
+                    device_widget.invalidate("settings")
+            if device_widget.dirty:
+                # a disconnected or re-enumerated camera may have
+                # reset, so every setting is applied again
+                device_widget.device.reset_applied()
+                device_widget.device.connected = connected
+                device_widget.device.details.update(details)
+                device_widget.refresh()
+
+        for uid, device in discovered_by_uid.items():
+            if uid not in self.devices_by_uid:
                 device_widget = DeviceItem(app=self)
                 device_widget.device.details = device
                 device_widget.device.connected = True
                 device_widget.update_details()
-                self.device_container.add_widget(device_widget)
-            else:
-                for child in self.device_container.children:
-                    if device["uid"] == child.device.details["uid"]:
-                        child.device.connected = True
-                        # update details since address may have changed
-                        child.device.details.update(device)
-                        child.update_details()
+                self.add_device(device_widget)
+        self.placeholder()
 
-    def update_env_values(self):
-        redis_conn.hgetall(self.env_key)
+    def view(self, thing, view_call, device_widget=None):
+        # process: one viewer process per thing
+        # viewer: one long lived viewer per view call, it is
+        #         started on the preview key of this db and
+        #         new things are written to that key
+        # pane: shown in the device_widget
+        call_dict = {
+            "host": self.db_host,
+            "port": self.db_port,
+            "thing": thing,
+            "thing_field": "binary_key",
+        }
+        if self.kwargs["preview_mode"] == "pane" and device_widget is not None:
+            device_widget.show_thing(thing)
+        elif self.kwargs["preview_mode"] == "viewer":
+            preview = {"thing": thing}
+            binary_key = redis_conn.hget(thing, "binary_key")
+            if binary_key is not None:
+                preview["binary_key"] = binary_key
+            # replace the hash so a binary_key of an earlier
+            # thing is not left behind
+            pipe = redis_conn.pipeline(transaction=True)
+            pipe.delete(self.preview_key)
+            pipe.hmset(self.preview_key, preview)
+            pipe.publish(self.preview_key, thing)
+            pipe.execute()
+            viewer = self.viewers.get(view_call)
+            if viewer is None or viewer.poll() is not None:
+                call_dict["thing"] = self.preview_key
+                self.viewers[view_call] = subprocess.Popen(
+                    view_call.format_map(call_dict).split(" ")
+                )
+        else:
+            subprocess.Popen(view_call.format_map(call_dict).split(" "))
 
-    def handle_db_events(self, message):
-        msg = message["channel"].replace("__keyspace@0__:", "")
-        if msg in (self.env_key):
-            Clock.schedule_once(lambda dt: self.update_env_values(), .1)
+    def capture_all(self):
+        # apply settings on every connected device in parallel,
+        # then slurp on all of them at close to the same moment
+        devices = [
+            child
+            for child in self.device_container.children
+            if hasattr(child, "device") and child.device.connected
+        ]
+        if not devices:
+            return
+        started = time.perf_counter()
+        # discover once for all devices instead of once per
+        # device worker, concurrent auto-detects compete for
+        # the usb bus right before the trigger
+        discovery_names = {
+            device_widget.device.details["discovery"] for device_widget in devices
+        }
+
+        def discover():
+            discovered = []
+            for name in discovery_names:
+                discovered.extend(self.device_classes[name].discover())
+            return discovered
+
+        future = self.discovery_pool.submit(discover)
+        future.add_done_callback(
+            lambda future: Clock.schedule_once(
+                lambda dt: self.capture_all_discovered(devices, future, started)
+            )
+        )
+
+    def capture_all_discovered(self, devices, discovery_future, started):
+        try:
+            discovered = discovery_future.result()
+        except Exception as ex:
+            # capture with the details already known
+            print("discovery: ", ex)
+            discovered = []
+        # devices may have been cleared while discovering
+        devices = [
+            device_widget
+            for device_widget in devices
+            if device_widget.parent is self.device_container
+        ]
+        # a device still busy with an earlier preview would
+        # only reach the barrier once that preview is done,
+        # every other device would wait for it, so it is skipped
+        busy = [
+            device_widget
+            for device_widget in devices
+            if device_widget.preview_future is not None
+            and not device_widget.preview_future.done()
+        ]
+        for device_widget in busy:
+            print("capture all: busy ", device_widget.device.details["uid"])
+            device_widget.set_progress("busy, skipped")
+        devices = [
+            device_widget for device_widget in devices if device_widget not in busy
+        ]
+        if not devices:
+            return
+        # a device that fails before the barrier aborts it, the
+        # timeout only bounds waiting for a slow device call
+        barrier = threading.Barrier(
+            len(devices), timeout=self.kwargs["capture_sync_timeout"]
+        )
+        futures = {}
+        done = False
+
+        def capture_all_done(future):
+            # scheduled once per future, only the first call
+            # after every future is done collects results
+            nonlocal done
+            if done or not all(f.done() for f in futures):
+                return
+            done = True
+            results = {}
+            for f, device_widget in futures.items():
+                result = device_widget.capture_done(f)
+                if result is not None:
+                    results[device_widget.device.details["uid"]] = result
+            self.capture_stats = self.capture_all_stats(results, started)
+            print(self.capture_stats)
+            self.capture_stats_label.text = (
+                "{captured}/{devices} captured, skew {skew:.3f}s, "
+                "{per_minute:.1f} captures/min".format(
+                    devices=len(devices), **self.capture_stats
+                )
+            )
+
+        for device_widget in devices:
+            future = device_widget.capture(
+                barrier=barrier, on_done=capture_all_done, discovered=discovered
+            )
+            futures[future] = device_widget
+
+    def capture_all_stats(self, results, started):
+        elapsed = time.perf_counter() - started
+        triggered = [result["triggered"] for result in results.values()]
+        captured = sum(len(result["slurped"]) for result in results.values())
+        return {
+            "captured": len(results),
+            "skew": max(triggered) - min(triggered) if triggered else 0,
+            "latency": {
+                uid: result["finished"] - result["triggered"]
+                for uid, result in results.items()
+            },
+            "setting_seconds": {
+                uid: result["setting_seconds"] for uid, result in results.items()
+            },
+            "seconds": elapsed,
+            "per_minute": captured / elapsed * 60 if elapsed else 0,
+        }
+
+    def conditions_pattern(self, device_widget):
+        return "settings:*:*:{}:{}:{}".format(
+            device_widget.device.details["uid"], self.db_host, self.db_port
+        )
+
+    def add_device(self, device_widget):
+        self.device_container.add_widget(device_widget)
+        self.devices_by_uid[device_widget.device.details["uid"]] = device_widget
+        self.db_events.watch_pattern(
+            self.conditions_pattern(device_widget),
+            lambda key, event, device_widget=device_widget: self.handle_device_events(
+                device_widget, key, event
+            ),
+        )
+
+    def remove_device(self, device_widget):
+        self.device_container.remove_widget(device_widget)
+        uid = device_widget.device.details["uid"]
+        if self.devices_by_uid.get(uid) is device_widget:
+            del self.devices_by_uid[uid]
+        self.db_events.unwatch_pattern(self.conditions_pattern(device_widget))
+        device_widget.cancel()
+        device_widget.worker.shutdown(wait=False)
+
+    def update_env_values(self):
+        # conditionals of every device are evaluated on env
+        # changes, matching settings are applied to the device
+        env = redis_conn.hgetall(self.env_key)
+        for device_widget in self.devices_by_uid.values():
+            device_widget.apply_conditionals(env)
+
+    def handle_db_events(self, key, event):
+        self.refresh.invalidate(key, self.update_env_values)
+
+    def handle_reference_events(self, key, event):
+        reference_cache.invalidate(key)
+        self.refresh.invalidate("reference", self.update_reference)
+
+    def update_reference(self):
+        for device_widget in self.devices_by_uid.values():
+            # look up devices that had no script again
+            if device_widget.device.details.get("scripts") is None:
+                device_widget.device.details.pop("scripts", None)
+            device_widget.invalidate("settings")
+            device_widget.refresh()
+
+    def handle_device_events(self, device_widget, key, event):
+        # coalesce per device, not per conditional key
+        self.refresh.invalidate(
+            self.conditions_pattern(device_widget), device_widget.update_conditions
+        )
 
     def load_session(self):
+        from lxml import etree
+
         expanded_path = os.path.expanduser(self.session_save_path)
         file = os.path.join(expanded_path, self.session_save_filename)
         try:
@@ -629,11 +1554,13 @@ class DevApp(App):
                     for settings in session.xpath("//settings"):
                         device_widget.device.settings = settings.attrib
                     device_widget.update_details()
-                    self.device_container.add_widget(device_widget)
+                    self.add_device(device_widget)
         except OSError as ex:
             pass
 
     def save_session(self):
+        from lxml import etree
+
         expanded_path = os.path.expanduser(self.session_save_path)
         if not os.path.isdir(expanded_path):
             print("creating: {}".format(expanded_path))
@@ -672,12 +1599,27 @@ class DevApp(App):
             os.path.join(expanded_path, self.session_save_filename), pretty_print=True
         )
 
+    def on_start(self):
+        if self.kwargs["startup_time"]:
+            # called on the first frame
+            Clock.schedule_once(lambda dt: self.report_startup())
+
+    def report_startup(self):
+        self.exit_status = startup_status(self.kwargs["startup_max"])
+        self.stop()
+
     def on_stop(self):
         # stop pubsub thread if window closed with '[x]'
-        self.db_event_subscription.thread.stop()
+        self.db_events.stop()
+        self.discovery_pool.shutdown(wait=False)
+        self.thumbnail_pool.shutdown(wait=False)
+        for child in self.device_container.children:
+            if hasattr(child, "worker"):
+                child.cancel()
+                child.worker.shutdown(wait=False)
 
     def app_exit(self):
-        self.db_event_subscription.thread.stop()
+        self.db_events.stop()
         App.get_running_app().stop()
 
 
@@ -690,6 +1632,60 @@ def main():
     parser.add_argument(
         "--db-port", type=int, help="db port, requires use of --db-host"
     )
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=0.1,
+        help="seconds to merge db events before refreshing, 0 for next frame",
+    )
+    parser.add_argument(
+        "--virtual-lists",
+        action="store_true",
+        help="only create widgets for visible settings rows",
+    )
+    parser.add_argument(
+        "--preview-mode",
+        choices=["process", "viewer", "pane"],
+        default="process",
+        help=(
+            "start a viewer per preview, reuse one viewer, or show in the device. "
+            "a reused viewer is started once on enn:preview:{host}:{port} "
+            "and must refresh when that hash changes or on a message "
+            "published to the channel of the same name"
+        ),
+    )
+    parser.add_argument(
+        "--usb-vendor",
+        nargs="+",
+        help="only rediscover on usb events from these vendor ids (hex, such as 04a9)",
+    )
+    parser.add_argument(
+        "--usb-settle",
+        type=float,
+        default=1.0,
+        help="seconds to merge usb events before rediscovering",
+    )
+    parser.add_argument(
+        "--capture-sync-timeout",
+        type=float,
+        default=30.0,
+        help="seconds capture all waits for every device to be ready before slurping",
+    )
+    parser.add_argument(
+        "--chdkptp-batch",
+        action="store_true",
+        help="apply the chdkptp settings of gphoto2 devices in one chdkptp run",
+    )
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        help="print seconds from process start to first frame and exit",
+    )
+    parser.add_argument(
+        "--startup-max",
+        type=float,
+        help="with --startup-time, exit with status 1 if slower than this many seconds",
+    )
     args = parser.parse_args()
 
     if bool(args.db_host) != bool(args.db_port):
@@ -698,3 +1694,4 @@ def main():
     app = DevApp(**vars(args))
     atexit.register(app.save_session)
     app.run()
+    sys.exit(app.exit_status)
@@ -6,9 +6,11 @@
 
 import argparse
 import atexit
+import sys
 
-import redis
-from ma_cli import data_models
+from enn_ui.db_events import KeyspaceWatcher, RefreshScheduler
+from enn_ui.virtual_list import VirtualList
+from enn_ui.startup import connect, startup_status
 
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
@@ -16,22 +18,50 @@ from kivy.clock import Clock
 from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+# connections are made once by connect() when the app starts
+binary_r = None
+redis_conn = None
+
+
+class EnvRow(RecycleDataViewBehavior, BoxLayout):
+    # row of the virtual env list, data is
+    # {"key", "value", "on_update", "on_remove"}
+    def __init__(self, **kwargs):
+        super(EnvRow, self).__init__(**kwargs)
+        self.row_data = {}
+        self.key_label = Label()
+        self.value_input = TextInput(multiline=False)
+        update = Button(text="update")
+        update.bind(
+            on_press=lambda widget: self.row_data["on_update"](
+                self.row_data["key"], self.value_input.text
+            )
+        )
+        remove = Button(text="remove")
+        remove.bind(
+            on_press=lambda widget: self.row_data["on_remove"](self.row_data["key"])
+        )
+        for widget in (self.key_label, self.value_input, update, remove):
+            self.add_widget(widget)
 
-r_ip, r_port = data_models.service_connection()
-binary_r = redis.StrictRedis(host=r_ip, port=r_port)
-redis_conn = redis.StrictRedis(host=r_ip, port=r_port, decode_responses=True)
+    def refresh_view_attrs(self, rv, index, data):
+        # keep whatever is being typed
+        if not (self.value_input.focus and self.row_data.get("key") == data["key"]):
+            self.value_input.text = str(data["value"])
+        self.key_label.text = str(data["key"])
+        self.row_data = data
 
 
 class EnvApp(App):
     def __init__(self, *args, **kwargs):
         # store kwargs to passthrough
         self.kwargs = kwargs
-        if kwargs["db_host"] and kwargs["db_port"]:
-            global binary_r
-            global redis_conn
-            db_settings = {"host": kwargs["db_host"], "port": kwargs["db_port"]}
-            binary_r = redis.StrictRedis(**db_settings)
-            redis_conn = redis.StrictRedis(**db_settings, decode_responses=True)
+        global binary_r
+        global redis_conn
+        binary_r, redis_conn = connect(kwargs["db_host"], kwargs["db_port"])
+        self.exit_status = 0
 
         self.db_port = redis_conn.connection_pool.connection_kwargs["port"]
         self.db_host = redis_conn.connection_pool.connection_kwargs["host"]
@@ -43,66 +73,120 @@ class EnvApp(App):
         root = BoxLayout()
         self.env_container = BoxLayout(orientation="vertical")
         root.add_widget(self.env_container)
-        self.update_env_values()
-        self.db_event_subscription = redis_conn.pubsub()
-        self.db_event_subscription.psubscribe(
-            **{"__keyspace@0__:*": self.handle_db_events}
-        )
-        # add thread to pubsub object to stop() on exit
-        self.db_event_subscription.thread = self.db_event_subscription.run_in_thread(
-            sleep_time=0.001
-        )
-        return root
-
-    def update_env_values(self):
-        env_values = redis_conn.hgetall(self.env_key)
-        self.env_container.clear_widgets()
+        # rows currently displayed by field, update_env_values
+        # reconciles these with the env hash
+        self.env_rows = {}
         info_label = Label(text="{}".format(self.env_key))
         self.env_container.add_widget(info_label)
-        for k, v in env_values.items():
-            row = BoxLayout()
-            key = Label(text=str(k))
-            value = TextInput(text=str(v), multiline=False)
-            update = Button(text="update")
-            update.bind(
-                on_press=lambda widget, key=k, value=value: redis_conn.hset(
-                    self.env_key, key, value.text
-                )
-            )
-            remove = Button(text="remove")
-            remove.bind(
-                on_press=lambda widget, key=k: redis_conn.hdel(self.env_key, key)
-            )
-
-            row.add_widget(key)
-            row.add_widget(value)
-            row.add_widget(update)
-            row.add_widget(remove)
-            self.env_container.add_widget(row)
         create_row = BoxLayout()
+        self.env_list = None
+        if self.kwargs["virtual_lists"]:
+            # rows are in a scrolling list that only
+            # creates widgets for visible rows
+            self.env_list = VirtualList(EnvRow)
+            self.env_container.add_widget(self.env_list)
+            for widget in (info_label, create_row):
+                widget.size_hint_y = None
+                widget.height = 30
         create_field = TextInput(hint_text="create field", multiline=False)
         create_field_value = TextInput(hint_text="field value", multiline=False)
         create_button = Button(text="create")
         create_button.bind(
-            on_press=lambda widget, key=create_field, value=create_field_value: redis_conn.hset(
-                self.env_key, key.text, value.text
+            on_press=lambda widget, key=create_field, value=create_field_value: self.create_env_field(
+                key, value
             )
         )
         for widget in (create_field, create_field_value, create_button):
             create_row.add_widget(widget)
         self.env_container.add_widget(create_row)
+        self.update_env_values()
+        # only subscribe to the env hash, other
+        # writes to the db are never delivered
+        self.db_events = KeyspaceWatcher(redis_conn)
+        self.refresh = RefreshScheduler(interval=self.kwargs["refresh_interval"])
+        self.db_events.watch(self.env_key, self.handle_db_events)
+        self.db_events.start()
+        return root
+
+    def update_env_values(self):
+        env_values = redis_conn.hgetall(self.env_key)
+        if self.env_list is not None:
+            self.env_list.data = [
+                {
+                    "key": k,
+                    "value": v,
+                    "on_update": self.update_env_field,
+                    "on_remove": self.remove_env_field,
+                }
+                for k, v in sorted(env_values.items())
+            ]
+            return
+
+        for k in [k for k in self.env_rows if k not in env_values]:
+            self.env_container.remove_widget(self.env_rows.pop(k))
+        for k, v in env_values.items():
+            row = self.env_rows.get(k)
+            if row is None:
+                row = self.env_row(k, v)
+                self.env_rows[k] = row
+                # above create_row
+                self.env_container.add_widget(row, index=1)
+            elif row.db_value != v:
+                row.db_value = v
+                # keep whatever is being typed
+                if not row.value_input.focus:
+                    row.value_input.text = str(v)
+
+    def env_row(self, k, v):
+        row = BoxLayout()
+        row.db_value = v
+        key = Label(text=str(k))
+        value = TextInput(text=str(v), multiline=False)
+        row.value_input = value
+        update = Button(text="update")
+        update.bind(
+            on_press=lambda widget, key=k, value=value: self.update_env_field(
+                key, value.text
+            )
+        )
+        remove = Button(text="remove")
+        remove.bind(on_press=lambda widget, key=k: self.remove_env_field(key))
+
+        row.add_widget(key)
+        row.add_widget(value)
+        row.add_widget(update)
+        row.add_widget(remove)
+        return row
+
+    def update_env_field(self, key, value):
+        redis_conn.hset(self.env_key, key, value)
+
+    def remove_env_field(self, key):
+        redis_conn.hdel(self.env_key, key)
+
+    def create_env_field(self, key, value):
+        redis_conn.hset(self.env_key, key.text, value.text)
+        key.text = ""
+        value.text = ""
+
+    def handle_db_events(self, key, event):
+        self.refresh.invalidate(key, self.update_env_values)
 
-    def handle_db_events(self, message):
-        msg = message["channel"].replace("__keyspace@0__:", "")
-        if msg in (self.env_key):
-            Clock.schedule_once(lambda dt: self.update_env_values(), .1)
+    def on_start(self):
+        if self.kwargs["startup_time"]:
+            # called on the first frame
+            Clock.schedule_once(lambda dt: self.report_startup())
+
+    def report_startup(self):
+        self.exit_status = startup_status(self.kwargs["startup_max"])
+        self.stop()
 
     def on_stop(self):
         # stop pubsub thread if window closed with '[x]'
-        self.db_event_subscription.thread.stop()
+        self.db_events.stop()
 
     def app_exit(self):
-        self.db_event_subscription.thread.stop()
+        self.db_events.stop()
         App.get_running_app().stop()
 
 
@@ -115,6 +199,27 @@ def main():
     parser.add_argument(
         "--db-port", type=int, help="db port, requires use of --db-host"
     )
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=0.1,
+        help="seconds to merge db events before refreshing, 0 for next frame",
+    )
+    parser.add_argument(
+        "--virtual-lists",
+        action="store_true",
+        help="only create widgets for visible rows, for envs with many fields",
+    )
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        help="print seconds from process start to first frame and exit",
+    )
+    parser.add_argument(
+        "--startup-max",
+        type=float,
+        help="with --startup-time, exit with status 1 if slower than this many seconds",
+    )
     args = parser.parse_args()
 
     if bool(args.db_host) != bool(args.db_port):
@@ -123,3 +228,4 @@ def main():
     app = EnvApp(**vars(args))
     # atexit.register(app.save_session)
     app.run()
+    sys.exit(app.exit_status)
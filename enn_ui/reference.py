@@ -5,13 +5,162 @@
 # Copyright (c) 2018, Galen Curwen-McAdams
 
 import argparse
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import marshal
+import mmap
+import os
+import sys
 import redis
 import pathlib
+import time
 from lxml import etree
 from ma_cli import data_models
 
+DEVICE_SCRIPT_LOOKUP_KEY = "device:script_lookup"
+SCRIPT_LOOKUP_KEY = "scripts:{}"
+# content digests of loaded xml files and scripts
+REFERENCE_DIGESTS_KEY = "reference:digests"
+FILES_DIGEST_FIELD = "files"
 
-def populate_db(db_host, db_port, xml_files=None, verbose=False):
+
+def parse_reference(xml_file):
+    # single pass over the document, calls are indexed
+    # by their parent script so each script hash only
+    # holds its own calls
+    devices = {}
+    reference = {DEVICE_SCRIPT_LOOKUP_KEY: devices}
+    xml = etree.parse(str(xml_file))
+    for element in xml.iter("call", "device"):
+        if element.tag == "device":
+            devices[element.get("name")] = element.get("script")
+        else:
+            script = element.getparent()
+            if script is None or script.tag != "script":
+                continue
+            calls = reference.setdefault(
+                SCRIPT_LOOKUP_KEY.format(script.get("name")), {}
+            )
+            calls[element.get("name")] = element.get("template")
+    return reference
+
+
+def load_reference(xml_file, cache_path=None):
+    # parse_reference through an on disk cache of marshalled
+    # results keyed by path, mtime and size, cached files
+    # are memory mapped and unmarshalled without parsing xml
+    if cache_path is None:
+        return parse_reference(xml_file)
+
+    xml_path = pathlib.Path(str(xml_file)).resolve()
+    xml_stat = xml_path.stat()
+    cache_dir = pathlib.Path(os.path.expanduser(cache_path), "reference")
+    path_digest = hashlib.sha1(str(xml_path).encode()).hexdigest()[:16]
+    version_digest = hashlib.sha1(
+        "{}:{}:{}".format(
+            xml_stat.st_mtime_ns, xml_stat.st_size, sys.version_info[:2]
+        ).encode()
+    ).hexdigest()[:16]
+    cache_file = cache_dir / "{}-{}.marshal".format(path_digest, version_digest)
+
+    try:
+        with open(str(cache_file), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return marshal.loads(mapped)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    reference = parse_reference(xml_path)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # remove entries for older versions of this file
+        for stale in cache_dir.glob("{}-*.marshal".format(path_digest)):
+            stale.unlink()
+        partial_file = cache_file.with_suffix(".partial")
+        with open(str(partial_file), "wb") as f:
+            marshal.dump(reference, f)
+        os.replace(str(partial_file), str(cache_file))
+    except OSError as ex:
+        print(ex)
+    return reference
+
+
+def parse_references(xml_files, jobs=1, cache_path=None):
+    # load_reference of every file merged into one
+    # reference, later files overwrite fields of
+    # earlier ones
+    load = functools.partial(load_reference, cache_path=cache_path)
+    if jobs > 1 and len(xml_files) > 1:
+        # parse in worker processes, map keeps file
+        # order so merging below is unchanged
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = list(pool.map(load, xml_files))
+    else:
+        parsed = map(load, xml_files)
+    reference = {}
+    for file_reference in parsed:
+        for key, fields in file_reference.items():
+            reference.setdefault(key, {}).update(fields)
+    return reference
+
+
+def iterparse_reference(xml_file):
+    # incremental parse yielding (key, fields) as each
+    # script or device closes, consumed elements are
+    # cleared so memory does not grow with file size
+    calls = None
+    for event, element in etree.iterparse(
+        str(xml_file), events=("start", "end"), tag=("script", "call", "device")
+    ):
+        if event == "start":
+            if element.tag == "script":
+                calls = {}
+            continue
+
+        if element.tag == "call":
+            script = element.getparent()
+            if script is not None and script.tag == "script":
+                calls[element.get("name")] = element.get("template")
+            continue
+
+        if element.tag == "script":
+            if calls:
+                yield SCRIPT_LOOKUP_KEY.format(element.get("name")), calls
+            calls = None
+        elif element.tag == "device":
+            yield DEVICE_SCRIPT_LOOKUP_KEY, {element.get("name"): element.get("script")}
+
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def content_digest(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(xml_file):
+    digest = hashlib.sha1()
+    with open(str(xml_file), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def populate_db(
+    db_host,
+    db_port,
+    xml_files=None,
+    verbose=False,
+    stream=False,
+    batch_size=1000,
+    incremental=True,
+    jobs=1,
+    cache_path="~/.cache/enn-ui/",
+):
     if db_port is None:
         r_ip, r_port = data_models.service_connection()
     else:
@@ -24,26 +173,135 @@ def populate_db(db_host, db_port, xml_files=None, verbose=False):
         ]
 
     redis_conn = redis.StrictRedis(host=r_ip, port=r_port, decode_responses=True)
-    device_script_lookup_key = "device:script_lookup"
-    script_lookup_key = "scripts:{}"
-    for xml_file in xml_files:
-        xml = etree.parse(str(xml_file))
-
-        for script in xml.xpath("//script"):
-            script_name = script.xpath("./@name")[0]
-            for call in script.xpath("//call"):
-                redis_conn.hset(
-                    script_lookup_key.format(script_name),
-                    call.xpath("./@name")[0],
-                    call.xpath("./@template")[0],
-                )
-
-        for device in xml.xpath("//device"):
-            redis_conn.hset(
-                device_script_lookup_key,
-                device.xpath("./@name")[0],
-                device.xpath("./@script")[0],
-            )
+    started = time.perf_counter()
+
+    # one digest for the ordered list of files, loading
+    # a different order or subset is not skipped since
+    # later files override fields of earlier ones
+    files_digest = content_digest(
+        [
+            [str(pathlib.Path(str(xml_file)).resolve()), file_digest(xml_file)]
+            for xml_file in xml_files
+        ]
+    )
+    if incremental:
+        if redis_conn.hget(REFERENCE_DIGESTS_KEY, FILES_DIGEST_FIELD) == files_digest:
+            stats = {"keys": 0, "fields": 0, "removed": 0, "skipped": len(xml_files)}
+            stats["seconds"] = time.perf_counter() - started
+            if verbose:
+                print("unchanged, skipped {skipped} files".format_map(stats))
+            return stats
+
+    if stream:
+        records = itertools.chain.from_iterable(
+            iterparse_reference(xml_file) for xml_file in xml_files
+        )
+        stats = stream_reference(redis_conn, records, batch_size=batch_size)
+    else:
+        # build every hash in memory first so each key
+        # is written once instead of once per field
+        reference = parse_references(xml_files, jobs=jobs, cache_path=cache_path)
+        stats = write_reference(redis_conn, reference, incremental=incremental)
+
+    redis_conn.hset(REFERENCE_DIGESTS_KEY, FILES_DIGEST_FIELD, files_digest)
+    stats["seconds"] = time.perf_counter() - started
+    if verbose:
+        print(
+            "wrote {keys} keys, {fields} fields, removed {removed} fields, "
+            "skipped {skipped} unchanged scripts in {seconds:.3f}s".format_map(stats)
+        )
+    return stats
+
+
+def write_reference(redis_conn, reference, incremental=False):
+    # multi-field writes in a single transaction,
+    # one round trip for the whole reference
+    #
+    # if incremental, scripts whose content digest matches
+    # the stored digest are skipped, the current hashes of
+    # the rest are read in one round trip and only changed
+    # fields are written, fields no longer in a script are
+    # deleted. otherwise every script is replaced. device
+    # lookup fields come from many files so they are only
+    # ever added or changed
+    stats = {"keys": 0, "fields": 0, "removed": 0, "skipped": 0}
+    digests = {
+        key: content_digest(fields)
+        for key, fields in reference.items()
+        if key != DEVICE_SCRIPT_LOOKUP_KEY and fields
+    }
+    current = {}
+    if incremental:
+        stored_digests = redis_conn.hgetall(REFERENCE_DIGESTS_KEY)
+        for key, digest in list(digests.items()):
+            if stored_digests.get(key) == digest:
+                del digests[key]
+                stats["skipped"] += 1
+        keys = [DEVICE_SCRIPT_LOOKUP_KEY] + list(digests)
+        fetch = redis_conn.pipeline(transaction=False)
+        for key in keys:
+            fetch.hgetall(key)
+        current = dict(zip(keys, fetch.execute()))
+
+    pipe = redis_conn.pipeline(transaction=True)
+    for key, fields in reference.items():
+        if not fields:
+            continue
+        stored = current.get(key, {})
+        removed = []
+        if key != DEVICE_SCRIPT_LOOKUP_KEY:
+            if key not in digests:
+                continue
+            if incremental:
+                removed = [k for k in stored if k not in fields]
+            else:
+                pipe.delete(key)
+            pipe.hset(REFERENCE_DIGESTS_KEY, key, digests[key])
+        fields = {k: v for k, v in fields.items() if stored.get(k) != v}
+
+        if removed:
+            pipe.hdel(key, *removed)
+            stats["removed"] += len(removed)
+        if fields:
+            pipe.hmset(key, fields)
+            stats["fields"] += len(fields)
+        if removed or fields:
+            stats["keys"] += 1
+    pipe.execute()
+    return stats
+
+
+def stream_reference(redis_conn, records, batch_size=1000):
+    # write in transactions of batch_size fields while
+    # parsing. each record is a whole script, the first
+    # time a script appears its key is deleted in the same
+    # transaction as the write so removed fields do not
+    # remain. a script may appear in several files, later
+    # records are merged with hmset the same way as the in
+    # memory update in populate_db. stored digests of
+    # written scripts are dropped so the next incremental
+    # load compares their fields again
+    pipe = redis_conn.pipeline(transaction=True)
+    stats = {"keys": 0, "fields": 0, "removed": 0, "skipped": 0}
+    written = set()
+    pending = 0
+    for key, fields in records:
+        if not fields:
+            continue
+        if key != DEVICE_SCRIPT_LOOKUP_KEY:
+            if key not in written:
+                pipe.delete(key)
+            pipe.hdel(REFERENCE_DIGESTS_KEY, key)
+        pipe.hmset(key, fields)
+        written.add(key)
+        stats["fields"] += len(fields)
+        pending += len(fields)
+        if pending >= batch_size:
+            pipe.execute()
+            pending = 0
+    pipe.execute()
+    stats["keys"] = len(written)
+    return stats
 
 
 def main():
@@ -51,7 +309,45 @@ def main():
     parser.add_argument("--db-host", default="127.0.0.1", help="db host ip")
     parser.add_argument("--db-port", default=None, help="db port")
     parser.add_argument("--xml-file", nargs="+", default=[], help="xml files")
-    parser.add_argument("--verbose", action="store_true", help="")
+    parser.add_argument(
+        "--verbose", action="store_true", help="print keys, fields and load time"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse incrementally and write in batches, for very large xml files",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="fields per batch with --stream"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="parse multiple xml files in this many processes",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="rewrite every script and device, even if unchanged",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always parse xml files instead of using cached results",
+    )
     args, unknown_args = parser.parse_known_args()
+    if args.stream and args.jobs > 1:
+        parser.error("--stream and --jobs can not be combined")
     args = vars(args)
-    populate_db(args["db_host"], args["db_port"], args["xml_file"])
+    populate_db(
+        args["db_host"],
+        args["db_port"],
+        args["xml_file"],
+        verbose=args["verbose"],
+        stream=args["stream"],
+        batch_size=args["batch_size"],
+        incremental=not args["full"],
+        jobs=args["jobs"],
+        cache_path=None if args["no_cache"] else "~/.cache/enn-ui/",
+    )
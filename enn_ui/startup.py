@@ -0,0 +1,52 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+import os
+import redis
+
+
+def seconds_since_start():
+    # wall time since this process started, including
+    # interpreter startup and module imports (linux only)
+    with open("/proc/self/stat") as f:
+        # fields after the parenthesized command name,
+        # starttime is field 22 in clock ticks since boot
+        start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+    with open("/proc/uptime") as f:
+        uptime = float(f.read().split()[0])
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def connect(db_host=None, db_port=None):
+    # returns (binary_r, redis_conn), each client has its own
+    # pool, one for binary and one for text replies. without
+    # a host and port the service connection of ma_cli is used
+    if db_host and db_port:
+        r_ip, r_port = db_host, db_port
+    else:
+        from ma_cli import data_models
+
+        r_ip, r_port = data_models.service_connection()
+    binary_r = redis.StrictRedis(
+        connection_pool=redis.ConnectionPool(host=r_ip, port=r_port)
+    )
+    redis_conn = redis.StrictRedis(
+        connection_pool=redis.ConnectionPool(
+            host=r_ip, port=r_port, decode_responses=True
+        )
+    )
+    return binary_r, redis_conn
+
+
+def startup_status(max_seconds=None):
+    # print seconds to first frame, returns the exit status,
+    # 1 if startup took longer than max_seconds
+    seconds = seconds_since_start()
+    print("first frame: {:.3f}s".format(seconds))
+    if max_seconds is not None and seconds > max_seconds:
+        print("slower than {:.3f}s".format(max_seconds))
+        return 1
+    return 0
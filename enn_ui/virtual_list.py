@@ -0,0 +1,25 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2018, Galen Curwen-McAdams
+
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+
+
+class VirtualList(RecycleView):
+    # rows are plain dicts in .data, widgets of viewclass
+    # are only created for rows in view and are reused
+    # while scrolling
+    def __init__(self, viewclass, row_height=30, **kwargs):
+        super(VirtualList, self).__init__(**kwargs)
+        self.viewclass = viewclass
+        layout = RecycleBoxLayout(
+            orientation="vertical",
+            default_size=(None, row_height),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+        )
+        layout.bind(minimum_height=layout.setter("height"))
+        self.add_widget(layout)
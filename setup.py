@@ -19,6 +19,7 @@ setup(
         "keli",
         "pyudev",
         "fold_ui",
+        "pillow",
         "pre-commit",
     ],
     dependency_links=[